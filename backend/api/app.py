@@ -6,6 +6,7 @@ from flask_cors import CORS
 from routes.global_agent import global_routes
 from routes.rag_agent import rag_routes
 from routes.web_search_agent import web_search_routes
+from services.runtime import runtime_stats
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -16,5 +17,11 @@ app.register_blueprint(global_routes, url_prefix='/api/global')
 app.register_blueprint(rag_routes, url_prefix='/api/rag')
 app.register_blueprint(web_search_routes, url_prefix='/api/websearch')
 
+
+@app.route('/api/runtime', methods=['GET'])
+def runtime():
+    # Tiempo de arranque y memoria de los servicios compartidos
+    return jsonify(runtime_stats()), 200
+
 if __name__ == '__main__':
     app.run(port=5328, debug=True)
\ No newline at end of file
@@ -0,0 +1,17 @@
+# api/asgi.py
+# Punto de entrada para servidores ASGI (uvicorn): expone los mismos blueprints que app.py.
+# WsgiToAsgi sigue ejecutando cada vista de Flask en un hilo de su pool; las vistas no son async.
+# La mejora de latencia no viene de servir por ASGI sino del event loop persistente de services.event_loop,
+# que usan igual `flask run` y este modo: los agentes de todas las peticiones se ejecutan en él y los clientes
+# HTTP de OpenAI/Tavily reutilizan sus conexiones entre peticiones.
+#   cd backend/api
+#   uvicorn asgi:asgi_app --host 0.0.0.0 --port 5328
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+from services.event_loop import get_loop
+
+# Arrancamos el loop compartido al cargar la aplicación y no en la primera petición
+get_loop()
+
+asgi_app = WsgiToAsgi(app)
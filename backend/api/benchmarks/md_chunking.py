@@ -0,0 +1,130 @@
+"""
+Benchmark del troceado de markdown: split_sections + split_chunks sobre el fichero leído entero (como antes)
+frente a iter_chunks en streaming. Cada variante se ejecuta en un proceso aparte para medir su pico de memoria.
+Antes de medir comprueba que ambas producen exactamente los mismos chunks, sobre el fichero generado
+y sobre textos aleatorios con los casos límite (tablas sangradas, encabezados sin espacio, \\f, \\r...).
+
+    cd backend/api
+    python -m benchmarks.md_chunking --mb 128
+"""
+import argparse
+import hashlib
+import io
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from services.md_chunker import iter_chunks
+from services.vector_db_utils import split_chunks, split_sections
+
+EDGE_PIECES = [
+    "# H1\n", "## Results 2023\n", "####### not a heading\n", "#nospace\n", "#\theading with tab\n",
+    "\n", "   \n", "\t\n", "\r\n", "  indented paragraph\n", "| a | b |\n", "|---|---|\n", "  | indented table |\n",
+    "word " * 50 + "\n", "x" * 900 + "\n", "x" * 2000 + "\n", "short line\n", "trailing spaces   \n",
+    "form\x0cfeed\n", "carriage\rreturn\n",
+]
+
+
+def make_markdown(path, megabytes, seed=0):
+    """Informe sintético: secciones con párrafos y tablas de cifras, y alguna sección muy larga."""
+    rnd = random.Random(seed)
+    words = "revenue ebitda margin growth net debt dividend segment tobacco logistics pharma italy france spain".split()
+    target = megabytes * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        section = 0
+        while written < target:
+            section += 1
+            parts = [f"{'#' * rnd.randint(1, 3)} Section {section} {rnd.randint(2015, 2024)}\n\n"]
+            n_blocks = 400 if section % 50 == 0 else rnd.randint(2, 12)
+            for _ in range(n_blocks):
+                if rnd.random() < 0.3:
+                    rows = "".join(f"| {rnd.choice(words)} | {rnd.randint(1, 99999):,} | {rnd.random() * 100:.1f}% |\n" for _ in range(rnd.randint(3, 15)))
+                    parts.append("| item | value | change |\n|---|---|---|\n" + rows + "\n")
+                else:
+                    parts.append(" ".join(rnd.choice(words) for _ in range(rnd.randint(10, 120))) + ".\n\n")
+            text = "".join(parts)
+            f.write(text)
+            written += len(text)
+
+
+def _digest(chunks):
+    digest = hashlib.sha256()
+    count = 0
+    for chunk in chunks:
+        digest.update(chunk.encode("utf-8"))
+        digest.update(b"\0")
+        count += 1
+    return count, digest.hexdigest()
+
+
+def _run_old(path):
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    return split_chunks(split_sections(content), target=1000, tol=150)
+
+
+def _run_new(path):
+    with open(path, "r", encoding="utf-8") as f:
+        yield from (chunk.text for chunk in iter_chunks(f, target=1000, tol=150))
+
+
+def _measure(variant, path, queue):
+    start = time.perf_counter()
+    count, digest = _digest(_run_old(path) if variant == "old" else _run_new(path))
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    queue.put((elapsed, peak_mb, count, digest))
+
+
+def measure(variant, path):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(variant, path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def check_edge_cases(trials=2000, seed=1):
+    rnd = random.Random(seed)
+    for _ in range(trials):
+        text = "".join(rnd.choice(EDGE_PIECES) for _ in range(rnd.randint(0, 60)))
+        if rnd.random() < 0.3:
+            text = text.rstrip("\n")
+        # Mismo texto que se obtiene al leer un fichero en modo texto (saltos de línea universales)
+        text = io.StringIO(text, newline=None).read()
+        expected = split_chunks(split_sections(text), target=1000, tol=150)
+        chunks = list(iter_chunks(io.StringIO(text)))
+        assert [c.text for c in chunks] == expected, f"chunks distintos para {text[:200]!r}"
+        for c in chunks:
+            assert text[c.start:c.end].split() == c.text.split(), f"posición incorrecta para {c.text[:80]!r}"
+    print(f"parity: {trials} random edge-case texts OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=128, help="tamaño del markdown generado")
+    parser.add_argument("--file", help="usar un markdown existente en vez de generarlo")
+    args = parser.parse_args()
+
+    check_edge_cases()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        if not path:
+            path = os.path.join(tmp, "report.md")
+            make_markdown(path, args.mb)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        old = measure("old", path)
+        new = measure("new", path)
+        assert old[2:] == new[2:], "los chunks no coinciden"
+        print(f"parity: {new[2]} chunks identical on {size_mb:.0f} MB")
+        print(f"{'variant':<40} {'time':>9} {'peak RSS':>10}")
+        print(f"{'split_sections + split_chunks':<40} {old[0]:8.2f}s {old[1]:8.0f}MB")
+        print(f"{'iter_chunks (streaming)':<40} {new[0]:8.2f}s {new[1]:8.0f}MB")
+        print(f"speed-up x{old[0] / new[0]:.2f}, memory x{old[1] / new[1]:.1f} less")
@@ -0,0 +1,61 @@
+"""
+Benchmark del parseo de PDFs: secuencial (un fichero tras otro, como antes) frente a process_pdfs
+en paralelo y con división por rangos de páginas. Usa LocalPdfParser con una latencia simulada
+por página, así que no necesita conexión ni clave de LlamaParse.
+
+    cd backend/api
+    python -m benchmarks.pdf_parsing --files 10 --pages 40 --delay 0.02
+"""
+import argparse
+import os
+import tempfile
+import time
+from functools import partial
+
+from pypdf import PdfWriter
+
+from services.vector_db_utils import LocalPdfParser, process_pdfs
+
+
+def make_pdfs(folder, n_files, n_pages):
+    names = []
+    for i in range(n_files):
+        writer = PdfWriter()
+        for _ in range(n_pages):
+            writer.add_blank_page(width=595, height=842)
+        name = f"report_{2015 + i}.pdf"
+        with open(os.path.join(folder, name), "wb") as f:
+            writer.write(f)
+        names.append(name)
+    return names
+
+
+def run(label, uploaded, processed, names, **kwargs):
+    start = time.perf_counter()
+    process_pdfs(uploaded, processed, names, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {elapsed:8.2f} s")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=0.02, help="latencia simulada por página (s)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--split", type=int, default=10, help="páginas por rango")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uploaded = os.path.join(tmp, "uploaded")
+        processed = os.path.join(tmp, "processed")
+        os.makedirs(uploaded)
+        names = make_pdfs(uploaded, args.files, args.pages)
+        factory = partial(LocalPdfParser, delay_per_page=args.delay)
+
+        base = run("sequential (1 worker, no split)", uploaded, processed, names, max_workers=1, parser_factory=factory)
+        par = run(f"parallel files ({args.workers} workers)", uploaded, processed, names, max_workers=args.workers, parser_factory=factory)
+        split = run(f"parallel files + {args.split}-page ranges", uploaded, processed, names,
+                    max_workers=args.workers, pages_per_split=args.split, parser_factory=factory)
+        print(f"speed-up: files x{base / par:.1f}, files+pages x{base / split:.1f}")
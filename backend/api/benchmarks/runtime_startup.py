@@ -0,0 +1,62 @@
+"""
+Compara el coste de arranque de un ChatService por blueprint (comportamiento anterior)
+con el registro compartido de services.runtime.
+El caso "before" no usa VectorStoreCache: como antes, cada GlobalAgent crea su propio cliente de
+embeddings y abre la colección de Chroma desde cero.
+
+    cd backend/api
+    python -m benchmarks.runtime_startup
+"""
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from services.runtime import _rss_mb
+from services.vectorstore_cache import VECTORSTORE_DIR
+
+
+class _UncachedVectorStores:
+    """Sustituto de vectorstore_cache que reproduce la construcción anterior, sin handles compartidos."""
+
+    def get(self, persist_directory: str = VECTORSTORE_DIR, collection_name: str = "langchain"):
+        from chromadb.api.client import SharedSystemClient
+        from langchain.embeddings import OpenAIEmbeddings
+        from langchain.vectorstores import Chroma
+
+        # Chroma reutiliza su cliente por directorio: se limpia para que cada apertura cueste lo que costaba
+        SharedSystemClient.clear_system_cache()
+        embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"), model="text-embedding-3-small")
+        return Chroma(persist_directory=persist_directory, collection_name=collection_name, embedding_function=embeddings)
+
+
+@contextmanager
+def uncached_vectorstores():
+    import services.agents.global_agents as global_agents
+    original = global_agents.vectorstore_cache
+    global_agents.vectorstore_cache = _UncachedVectorStores()
+    try:
+        yield
+    finally:
+        global_agents.vectorstore_cache = original
+
+
+def measure(label, build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<32} {elapsed:8.3f} s   {peak / 1024 / 1024:8.1f} MB (python heap)   rss={_rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    from services.chat_service import ChatService
+    from services.runtime import get_chat_service
+
+    # Antes: cada blueprint (global, rag, websearch) construía su propio ChatService al importarse
+    with uncached_vectorstores():
+        measure("before: 3 x ChatService()", lambda: [ChatService() for _ in range(3)])
+    # Después: los tres blueprints comparten la misma instancia
+    measure("after: shared runtime (3 calls)", lambda: [get_chat_service() for _ in range(3)])
@@ -0,0 +1,81 @@
+"""
+Benchmark de la fase de búsqueda + notas de WebSearchAgent.busqueda: una sola llamada de notas tras esperar
+a todas las búsquedas (notes_mode="single", como antes) frente al map-reduce en cadena (notes_mode="pipelined").
+Tavily y el modelo se simulan: cada búsqueda tarda un tiempo aleatorio y el modelo tarda `ttft` más
+los tokens de salida (proporcionales a la entrada, con un máximo) a `tps` tokens por segundo.
+No necesita conexión ni claves.
+
+    cd backend/api
+    python -m benchmarks.web_notes --queries 6 --runs 3
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+import services.agents.asyncwebsearch as web
+from services.agents.search_cache import SearchCache
+
+
+class SimulatedModel:
+    def __init__(self, ttft: float, tps: float, output_ratio: float, max_output: int):
+        self.ttft = ttft
+        self.tps = tps
+        self.output_ratio = output_ratio
+        self.max_output = max_output
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        output_tokens = min(self.max_output, self.output_ratio * len(str(prompt)) / 4)
+        await asyncio.sleep(self.ttft + output_tokens / self.tps)
+        return SimpleNamespace(content="notes " * int(output_tokens))
+
+
+def simulated_search(rnd, min_delay, max_delay, result_chars):
+    async def search(query, **params):
+        await asyncio.sleep(rnd.uniform(min_delay, max_delay))
+        return {"results": [{"url": f"https://example.com/{query.replace(' ', '-')}/{i}", "content": f"{query} " + "x" * result_chars}
+                            for i in range(params.get("max_results", 3))]}
+    return search
+
+
+async def run_once(mode, args, seed):
+    rnd = random.Random(seed)
+    web.async_tavily = SimpleNamespace(search=simulated_search(rnd, args.search_min, args.search_max, args.result_chars))
+    web.search_cache = SearchCache()  # sin resultados previos: cada variante hace todas sus búsquedas
+    model = SimulatedModel(args.ttft, args.tps, args.output_ratio, args.max_output)
+    agent = web.WebSearchAgent(model, notes_mode=mode, notes_concurrency=args.concurrency)
+    state = {
+        "company": "Logista", "extraction_schema": web.ESQUEMA, "user_notes": "",
+        "pending_sections": ",".join(f"section_{i}" for i in range(args.queries)),
+        "queries": [f"Logista query {i}" for i in range(args.queries)],
+        "search_results": [], "info_compilada": [], "is_complete": False, "iteraciones": 0,
+    }
+    start = time.perf_counter()
+    await agent.busqueda(state, lambda event: None)
+    return time.perf_counter() - start, model.calls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=6)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--search-min", type=float, default=0.5, help="latencia mínima de una búsqueda (s)")
+    parser.add_argument("--search-max", type=float, default=3.0, help="latencia máxima de una búsqueda (s)")
+    parser.add_argument("--result-chars", type=int, default=3000, help="caracteres de cada resultado")
+    parser.add_argument("--ttft", type=float, default=0.6, help="tiempo hasta el primer token (s)")
+    parser.add_argument("--tps", type=float, default=90.0, help="tokens de salida por segundo")
+    parser.add_argument("--output-ratio", type=float, default=0.25, help="tokens de salida por token de entrada")
+    parser.add_argument("--max-output", type=int, default=2500)
+    parser.add_argument("--concurrency", type=int, default=4, help="llamadas de notas simultáneas")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("single", "pipelined"):
+        timings = [asyncio.run(run_once(mode, args, seed)) for seed in range(args.runs)]
+        results[mode] = statistics.median(t for t, _ in timings)
+        print(f"{mode:<10} median {results[mode]:6.2f} s   ({timings[0][1]} LLM calls per run)")
+    print(f"speed-up x{results['single'] / results['pipelined']:.2f}")
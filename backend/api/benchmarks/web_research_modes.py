@@ -0,0 +1,96 @@
+"""
+Benchmark del grafo completo de WebSearchAgent en sus dos modos: "thorough" (queries, búsqueda + notas,
+compilación y reflexión) frente a "fast" (queries y una sola compilación sobre los resultados en bruto).
+Mide el tiempo total, el tiempo hasta el primer token del informe y las llamadas al LLM, con Tavily y el
+modelo simulados como en benchmarks.web_notes. No necesita conexión ni claves.
+
+    cd backend/api
+    python -m benchmarks.web_research_modes --queries 6 --runs 3
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessageChunk
+
+import services.agents.asyncwebsearch as web
+from services.agents.search_cache import SearchCache
+from services.agents.token_stream import TOKEN_KEY
+from benchmarks.web_notes import SimulatedModel, simulated_search
+
+
+class SimulatedStructured:
+    """Salida estructurada simulada (queries y reflexión): respuestas cortas de `tokens` tokens."""
+
+    def __init__(self, model: "SimulatedGraphModel", schema, tokens: int = 120):
+        self.model = model
+        self.schema = schema
+        self.tokens = tokens
+
+    async def ainvoke(self, prompt):
+        self.model.calls += 1
+        await asyncio.sleep(self.model.ttft + self.tokens / self.model.tps)
+        if isinstance(self.schema, dict):
+            props = self.schema["properties"]["queries"]["properties"]
+            return {"queries": {name: f"Logista {name}" for name in props}}
+        return self.schema(is_answered=True, pending_sections="", analysis="")
+
+
+class SimulatedGraphModel(SimulatedModel):
+    """SimulatedModel con streaming (compilador) y salida estructurada, para recorrer el grafo entero."""
+
+    def with_structured_output(self, schema):
+        return SimulatedStructured(self, schema)
+
+    async def astream(self, prompt, chunk_tokens: int = 20):
+        self.calls += 1
+        output_tokens = int(min(self.max_output, self.output_ratio * len(str(prompt)) / 4))
+        await asyncio.sleep(self.ttft)
+        for _ in range(0, output_tokens, chunk_tokens):
+            await asyncio.sleep(chunk_tokens / self.tps)
+            yield AIMessageChunk(content="report " * chunk_tokens)
+
+
+async def run_once(mode, args, seed):
+    rnd = random.Random(seed)
+    web.async_tavily = SimpleNamespace(search=simulated_search(rnd, args.search_min, args.search_max, args.result_chars))
+    web.search_cache = SearchCache()
+    model = SimulatedGraphModel(args.ttft, args.tps, args.output_ratio, args.max_output)
+    agent = web.WebSearchAgent(model, mode=mode)
+    state = web.WebAgentState(
+        company="Logista", extraction_schema=web.ESQUEMA, user_notes="",
+        pending_sections=",".join(f"section_{i}" for i in range(args.queries)),
+        queries=[], search_results=[], info_compilada=[], is_complete=False, iteraciones=0,
+    )
+    start = time.perf_counter()
+    first_token = None
+    async for chunk in agent.graph.astream(state, stream_mode="custom"):
+        if first_token is None and chunk.get(TOKEN_KEY, {}).get("text"):
+            first_token = time.perf_counter() - start
+    return time.perf_counter() - start, first_token, model.calls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=6)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--search-min", type=float, default=0.5, help="latencia mínima de una búsqueda (s)")
+    parser.add_argument("--search-max", type=float, default=3.0, help="latencia máxima de una búsqueda (s)")
+    parser.add_argument("--result-chars", type=int, default=3000, help="caracteres de cada resultado")
+    parser.add_argument("--ttft", type=float, default=0.6, help="tiempo hasta el primer token (s)")
+    parser.add_argument("--tps", type=float, default=90.0, help="tokens de salida por segundo")
+    parser.add_argument("--output-ratio", type=float, default=0.25, help="tokens de salida por token de entrada")
+    parser.add_argument("--max-output", type=int, default=2500)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in web.WEB_MODES:
+        timings = [asyncio.run(run_once(mode, args, seed)) for seed in range(args.runs)]
+        results[mode] = statistics.median(t for t, _, _ in timings)
+        first_token = statistics.median(f for _, f, _ in timings)
+        print(f"{mode:<9} median {results[mode]:6.2f} s   first report token {first_token:6.2f} s   "
+              f"({timings[0][2]} LLM calls per run)")
+    print(f"speed-up x{results['thorough'] / results['fast']:.2f}")
@@ -1,12 +1,11 @@
-from flask import Blueprint, request, jsonify
-from services.chat_service import ChatService
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from services.runtime import get_chat_service, get_ingestion_jobs
+from services.agents.asyncwebsearch import WEB_MODES
+from services.sse import SSE_HEADERS, chunk_to_event, format_sse
 from services.file_processor import process_files
-from services.vector_db import VectorDBService
 
 
-chat_service = ChatService()
 global_routes = Blueprint('global', __name__)
-vector_db_service = VectorDBService()
 
 
 @global_routes.route('/chat', methods=['POST'])
@@ -19,22 +18,56 @@ def chat():
         schema = ""
     print("ESQUEMA: ", schema)
     conversation_id = data.get("conversation_id", "1")
+    # "fast": investigación web en una sola pasada (menos llamadas al LLM); por defecto la completa
+    web_mode = data.get("web_mode", "thorough")
+    if web_mode not in WEB_MODES:
+        return jsonify({"error": f"web_mode must be one of {', '.join(WEB_MODES)}"}), 400
     if not message:
         return jsonify({"error": "Conversation id is required"}), 400
     
     if not message:
         return jsonify({"error": "Message is required"}), 400
 
-    result = chat_service.process_query_global_agent(message, conversation_id, schema,rag_only=True, web_only=True)
+    try:
+        result = get_chat_service().process_query_global_agent(message, conversation_id, schema,rag_only=True, web_only=True, web_mode=web_mode)
+    except TimeoutError as e:
+        # Se ha agotado el tiempo máximo de la petición (AGENT_REQUEST_TIMEOUT)
+        return jsonify({"status": "error", "error": str(e)}), 504
     print("TODO BIEN HASTA AQUI")
     print(result)
     return jsonify(result), 200
 
+@global_routes.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json() or {}
+
+    message = data.get("message", "")
+    schema = data.get("schema", "")
+    if schema =="No schema provided, look for the required information" or schema == "No schema provided, look for the information required":
+        schema = ""
+    conversation_id = data.get("conversation_id", "1")
+    # "fast": investigación web en una sola pasada (menos llamadas al LLM); por defecto la completa
+    web_mode = data.get("web_mode", "thorough")
+    if web_mode not in WEB_MODES:
+        return jsonify({"error": f"web_mode must be one of {', '.join(WEB_MODES)}"}), 400
+    if not message:
+        return jsonify({"error": "Message is required"}), 400
+
+    def generate():
+        for chunk in get_chat_service().stream_query_global_agent(message, conversation_id, schema, rag_only=True, web_only=True, web_mode=web_mode):
+            event = chunk_to_event(chunk)
+            if event:
+                yield format_sse(event)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
 @global_routes.route('/upload', methods=['POST'])
 def upload():
     files = request.files.getlist('files')
     # conv = request.form.get('conversation_id')
     metadata = process_files(files)
+    # El parseo de los ficheros empieza ya, en segundo plano
+    get_ingestion_jobs().start_parsing([f["name"] for f in metadata])
     return jsonify({"status": "success", "files": metadata})
 
 @global_routes.route('/generate-vector-db', methods=['POST'])
@@ -49,11 +82,19 @@ def gen_db():
             "message": "Missing file_paths or conversation_id"
         }), 400
 
-    try:
-        result = vector_db_service.create_vector_db(file_paths, conversation_id)
-        return jsonify(result), 200
-    except Exception as e: # @TODO: refine exception handling, for now this will do
-        return jsonify({
-            "status": "error",
-            "message": f"Vector DB creation failed: {str(e)}"
-        }), 500
\ No newline at end of file
+    if isinstance(file_paths[0], dict):
+        file_paths = [f["name"] for f in file_paths]
+    # La ingesta se ejecuta en segundo plano, se devuelve el id del trabajo para consultar su estado
+    job_id = get_ingestion_jobs().submit(file_paths, conversation_id)
+    return jsonify({
+        "status": "success",
+        "message": "Vector DB creation started",
+        "job_id": job_id,
+    }), 202
+
+@global_routes.route('/generate-vector-db/<job_id>', methods=['GET'])
+def gen_db_status(job_id):
+    job = get_ingestion_jobs().status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job id"}), 404
+    return jsonify(job), 200
\ No newline at end of file
@@ -1,11 +1,9 @@
-from flask import Blueprint, request, jsonify
-from services.chat_service import ChatService
-from services.vector_db import VectorDBService
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from services.runtime import get_chat_service, get_ingestion_jobs
+from services.sse import SSE_HEADERS, chunk_to_event, format_sse
 from services.file_processor import process_files
 
 rag_routes = Blueprint('rag', __name__)
-chat_service = ChatService()
-vector_db_service = VectorDBService()
 
 @rag_routes.route('/chat', methods=['POST'])
 def chat():
@@ -18,17 +16,39 @@ def chat():
     
     if not message:
         return jsonify({"error": "Message is required"}), 400
-    result = chat_service.process_query_global_agent(message, conversation_id, "", rag_only=True, web_only=False)
+    try:
+        result = get_chat_service().process_query_global_agent(message, conversation_id, "", rag_only=True, web_only=False)
+    except TimeoutError as e:
+        # Se ha agotado el tiempo máximo de la petición (AGENT_REQUEST_TIMEOUT)
+        return jsonify({"status": "error", "error": str(e)}), 504
     print("TODO BIEN HASTA AQUI")
     print(result)
     return jsonify(result), 200
 
+@rag_routes.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json() or {}
+
+    message = data.get("message", "")
+    conversation_id = data.get("conversation_id", "1")
+    if not message:
+        return jsonify({"error": "Message is required"}), 400
+
+    def generate():
+        for chunk in get_chat_service().stream_query_global_agent(message, conversation_id, "", rag_only=True, web_only=False):
+            event = chunk_to_event(chunk)
+            if event:
+                yield format_sse(event)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
 @rag_routes.route('/upload', methods=['POST'])
 def upload():
     files = request.files.getlist('files')
     # conv = request.form.get('conversation_id')
     metadata = process_files(files)
-    # @TODO: podría guardar aquí los archivos y hacer el preprocesado
+    # El parseo de los ficheros empieza ya, en segundo plano
+    get_ingestion_jobs().start_parsing([f["name"] for f in metadata])
     return jsonify({"status": "success", "files": metadata})
 
 @rag_routes.route('/generate-vector-db', methods=['POST'])
@@ -43,11 +63,19 @@ def gen_db():
             "message": "Missing file_paths or conversation_id"
         }), 400
 
-    try:
-        result = vector_db_service.create_vector_db(file_paths, conversation_id)
-        return jsonify(result), 200
-    except Exception as e: # @TODO: refine exception handling, for now this will do
-        return jsonify({
-            "status": "error",
-            "message": f"Vector DB creation failed: {str(e)}"
-        }), 500
\ No newline at end of file
+    if isinstance(file_paths[0], dict):
+        file_paths = [f["name"] for f in file_paths]
+    # La ingesta se ejecuta en segundo plano, se devuelve el id del trabajo para consultar su estado
+    job_id = get_ingestion_jobs().submit(file_paths, conversation_id)
+    return jsonify({
+        "status": "success",
+        "message": "Vector DB creation started",
+        "job_id": job_id,
+    }), 202
+
+@rag_routes.route('/generate-vector-db/<job_id>', methods=['GET'])
+def gen_db_status(job_id):
+    job = get_ingestion_jobs().status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job id"}), 404
+    return jsonify(job), 200
\ No newline at end of file
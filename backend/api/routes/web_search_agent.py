@@ -1,7 +1,8 @@
-from flask import Blueprint, request, jsonify
-from services.chat_service import ChatService
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from services.runtime import get_chat_service
+from services.agents.asyncwebsearch import WEB_MODES
+from services.sse import SSE_HEADERS, chunk_to_event, format_sse
 
-chat_service = ChatService()
 web_search_routes = Blueprint('websearch', __name__)
 
 @web_search_routes.route('/chat', methods=['POST'])
@@ -14,13 +15,45 @@ def chat():
         schema = ""
     print("----SCHEMA: ", schema)
     conversation_id = data.get("conversation_id", "1")
+    # "fast": investigación web en una sola pasada (menos llamadas al LLM); por defecto la completa
+    web_mode = data.get("web_mode", "thorough")
+    if web_mode not in WEB_MODES:
+        return jsonify({"error": f"web_mode must be one of {', '.join(WEB_MODES)}"}), 400
     if not message:
         return jsonify({"error": "Conversation id is required"}), 400
     
     if not message:
         return jsonify({"error": "Message is required"}), 400
 
-    result = chat_service.process_query_global_agent(message, conversation_id, schema,rag_only=False, web_only=True)
+    try:
+        result = get_chat_service().process_query_global_agent(message, conversation_id, schema,rag_only=False, web_only=True, web_mode=web_mode)
+    except TimeoutError as e:
+        # Se ha agotado el tiempo máximo de la petición (AGENT_REQUEST_TIMEOUT)
+        return jsonify({"status": "error", "error": str(e)}), 504
     print("TODO BIEN HASTA AQUI")
     print(result)
-    return jsonify(result), 200
\ No newline at end of file
+    return jsonify(result), 200
+
+@web_search_routes.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json() or {}
+
+    message = data.get("message", "")
+    schema = data.get("schema", "")
+    if schema =="No schema provided, look for the required information":
+        schema = ""
+    conversation_id = data.get("conversation_id", "1")
+    # "fast": investigación web en una sola pasada (menos llamadas al LLM); por defecto la completa
+    web_mode = data.get("web_mode", "thorough")
+    if web_mode not in WEB_MODES:
+        return jsonify({"error": f"web_mode must be one of {', '.join(WEB_MODES)}"}), 400
+    if not message:
+        return jsonify({"error": "Message is required"}), 400
+
+    def generate():
+        for chunk in get_chat_service().stream_query_global_agent(message, conversation_id, schema, rag_only=False, web_only=True, web_mode=web_mode):
+            event = chunk_to_event(chunk)
+            if event:
+                yield format_sse(event)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
\ No newline at end of file
@@ -9,13 +9,20 @@ from langgraph.graph import StateGraph, END
 from langgraph.types import StreamWriter
 from services.agents.web_search_agent_utils import (
     QUERY_PROMPT, NOTES_PROMPT, COMPILER_PROMPT,
-    REFLECTION_PROMPT, extract_clean_text, query_prompt_Nsch, notes_prompt_Nsch, compilador_prompt_Nsch, reflection_prompt_Nsch
+    REFLECTION_PROMPT, FAST_COMPILER_PROMPT, extract_clean_text, query_prompt_Nsch, notes_prompt_Nsch,
+    compilador_prompt_Nsch, reflection_prompt_Nsch, fast_compilador_prompt_Nsch
 )
+from services.agents.llm_cache import with_cache
+from services.agents.search_cache import SEARCH_CACHE_PATH, SearchCache
+from services.agents.token_stream import astream_text
+from services.agents.deadline import low_budget
 from tavily import AsyncTavilyClient
 
 # --- Carga variables de entorno ---
 _ = load_dotenv()
 async_tavily = AsyncTavilyClient(os.getenv("TAVILY_API_KEY"))
+# Cache de resultados de Tavily compartida por todas las peticiones del proceso
+search_cache = SearchCache(persist_path=SEARCH_CACHE_PATH)
 
 # --- Esquema de extracción ---
 ESQUEMA = """
@@ -65,9 +72,14 @@ class Reflection_Nsch(BaseModel):
 max_iteraciones = 1
 max_search_results = 3
 max_search_queries = 5
+# "thorough": queries -> búsqueda + notas -> compilación -> reflexión (puede iterar)
+# "fast": queries -> búsqueda + compilación en una sola llamada sobre los resultados, sin reflexión (2 llamadas al LLM)
+WEB_MODES = ("thorough", "fast")
 
 class WebSearchAgent:
-    def __init__(self, model):
+    def __init__(self, model, llm_cache=None, mode: str = "thorough", notes_mode: str = "pipelined", notes_concurrency: int = 4):
+        if mode not in WEB_MODES:
+            raise ValueError(f"Unknown web research mode: {mode!r} (expected one of {WEB_MODES})")
         self.query_prompt = QUERY_PROMPT
         self.notes_prompt = NOTES_PROMPT
         self.compilador_prompt = COMPILER_PROMPT
@@ -76,8 +88,21 @@ class WebSearchAgent:
         self.notes_prompt_Nsch = notes_prompt_Nsch
         self.compilador_prompt_Nsch = compilador_prompt_Nsch
         self.reflection_prompt_Nsch = reflection_prompt_Nsch
+        self.fast_compilador_prompt = FAST_COMPILER_PROMPT
+        self.fast_compilador_prompt_Nsch = fast_compilador_prompt_Nsch
+        self.mode = mode
         self.urls = []
         self._sem = asyncio.Semaphore(5)
+        # "pipelined": notas por query en cuanto llegan sus resultados (map) y se unen al final (reduce)
+        # "single": una sola llamada con los resultados de todas las queries
+        self.notes_mode = notes_mode
+        self._notes_sem = asyncio.Semaphore(notes_concurrency)
+        self.graph = self._fast_graph() if mode == "fast" else self._thorough_graph()
+        self.model = model
+        # Modelo con cache de respuestas para la generación de queries y la reflexión
+        self.cached_model = with_cache(model, llm_cache)
+
+    def _thorough_graph(self):
         graph = StateGraph(WebAgentState)
         graph.add_node("gen_query", self.query_generation)
         graph.add_node("buscar", self.busqueda)
@@ -92,8 +117,16 @@ class WebSearchAgent:
             {True: END, False: "gen_query"}
         )
         graph.set_entry_point("gen_query")
-        self.graph = graph.compile()
-        self.model = model
+        return graph.compile()
+
+    def _fast_graph(self):
+        graph = StateGraph(WebAgentState)
+        graph.add_node("gen_query", self.query_generation)
+        graph.add_node("buscar_compilar", self.busqueda_compilador)
+        graph.add_edge("gen_query", "buscar_compilar")
+        graph.add_edge("buscar_compilar", END)
+        graph.set_entry_point("gen_query")
+        return graph.compile()
 
     async def query_generation(self, state: WebAgentState, writer: StreamWriter) -> dict[str, Any]:
         writer({"custom_key": f" Generating queries iter {state['iteraciones']+1} ..."})
@@ -115,7 +148,7 @@ class WebSearchAgent:
                 past_queries=state["queries"] or []
             )
         schema = generate_json_schema(count)
-        struc = self.model.with_structured_output(schema)
+        struc = self.cached_model.with_structured_output(schema)
         response = await struc.ainvoke(prompt)
         queries = list(response['queries'].values())
         writer({"custom_key": f" End query gen {state['iteraciones']+1}."})
@@ -123,23 +156,80 @@ class WebSearchAgent:
         return {"queries": queries}
 
     async def _search_one(self, query: str):
-        async with self._sem:
-            try:
-                return await async_tavily.search(
-                    query=query,
-                    max_results=max_search_results,
-                    include_images=False,
-                    include_answer=False
-                )
-            except Exception as e:
-                return e
+        params = {"max_results": max_search_results, "include_images": False, "include_answer": False}
+
+        async def fetch():
+            async with self._sem:
+                return await async_tavily.search(query=query, **params)
+
+        try:
+            return await search_cache.get_or_fetch(query, fetch, **params)
+        except Exception as e:
+            return e
+
+    def _notes_prompt(self, state: WebAgentState, content) -> str:
+        if state["extraction_schema"]:
+            return self.notes_prompt.format(
+                company=state["company"],
+                schema=state["extraction_schema"],
+                content=content,
+            )
+        return self.notes_prompt_Nsch.format(
+            company=state["company"],
+            instructions=state["user_notes"],
+            content=content,
+        )
 
     async def busqueda(self, state: WebAgentState, writer: StreamWriter) -> dict[str, Any]:
         writer({"custom_key": f" Launching web search iter {state['iteraciones']+1} ..."})
         partes = state["pending_sections"].split(",") if state["pending_sections"] else []
         queries = state['queries'][-len(partes):] if partes else state['queries']
+        if self.notes_mode == "pipelined":
+            notes = await self._notes_pipelined(state, queries, writer)
+        else:
+            notes = await self._notes_single(state, queries, writer)
+        writer({"custom_key": " Successfully received and extracted web search results!"})
+        return {"search_results": notes}
+
+    async def _notes_pipelined(self, state: WebAgentState, queries: list[str], writer: StreamWriter) -> str:
+        """
+        Map-reduce en cadena: las notas de cada query se piden en cuanto llegan sus resultados (como mucho
+        `notes_concurrency` a la vez), sin esperar a la búsqueda más lenta, y cada llamada lleva un prompt pequeño.
+        El reduce no llama al LLM: une las notas por query en su orden bajo un encabezado. El nodo siguiente
+        (compilador) ya es una llamada al LLM que integra todas las notas en el informe; un reduce con LLM
+        antes de él solo añadiría otra ronda de latencia.
+        """
+        async def search(i: int, query: str):
+            return i, query, await self._search_one(query)
+
+        async def take_notes(query: str, texts: list[str]) -> str:
+            async with self._notes_sem:
+                result = await self.model.ainvoke(self._notes_prompt(state, {query: texts}))
+            return result.content
+
+        notes: dict[int, asyncio.Task] = {}
+        try:
+            # Búsquedas y notas pertenecen al grupo: si algo falla o se cancela la petición, se cancela todo
+            async with asyncio.TaskGroup() as group:
+                searches = [group.create_task(search(i, q)) for i, q in enumerate(queries)]
+                for finished in asyncio.as_completed(searches):
+                    i, query, res = await finished
+                    if isinstance(res, Exception):
+                        writer({"custom_key": f"⚠️ Search failed: {res}"})
+                        continue
+                    texts = [r['content'] for r in res['results']]
+                    if texts:
+                        notes[i] = group.create_task(take_notes(query, texts))
+                writer({"custom_key": f" Search cache: {search_cache.stats()}"})
+        except ExceptionGroup as group_error:
+            # El ExceptionGroup del TaskGroup oculta el error real: se relanza el primero
+            raise group_error.exceptions[0]
+        return "\n\n".join(f"### Notes for query: {queries[i]}\n{notes[i].result()}" for i in sorted(notes))
+
+    async def _notes_single(self, state: WebAgentState, queries: list[str], writer: StreamWriter) -> str:
         tasks = [self._search_one(q) for q in queries]
         results = await asyncio.gather(*tasks, return_exceptions=True)
+        writer({"custom_key": f" Search cache: {search_cache.stats()}"})
         compiled = []
         for res in results:
             if isinstance(res, Exception):
@@ -148,21 +238,8 @@ class WebSearchAgent:
             else:
                 texts = [r['content'] for r in res['results']]
                 compiled.append(texts)
-        if state["extraction_schema"]:
-            prompt = self.notes_prompt.format(
-                company=state["company"],
-                schema=state["extraction_schema"],
-                content=compiled,
-            )
-        else:
-            prompt = self.notes_prompt_Nsch.format(
-                company=state["company"],
-                instructions=state["user_notes"],
-                content=compiled,
-            )
-        result = await self.model.ainvoke(prompt)
-        writer({"custom_key": " Successfully received and extracted web search results!"})
-        return {"search_results": result.content}
+        result = await self.model.ainvoke(self._notes_prompt(state, compiled))
+        return result.content
 
     async def compilador(self, state: WebAgentState, writer: StreamWriter) -> dict[str, Any]:
         writer({"custom_key": " Compiling data ..."})
@@ -179,14 +256,62 @@ class WebSearchAgent:
                 report=prev,
                 content=state['search_results'],
             )
-        result = await self.model.ainvoke(prompt)
+        # El informe se emite según se escribe (token_key); el completo sigue llegando en web_key
+        info_compilada = await astream_text(self.model, prompt, writer, "web")
         writer({"custom_key": " End of data compilation."})
-        return {"info_compilada": result.content}
+        return {"info_compilada": info_compilada}
+
+    async def busqueda_compilador(self, state: WebAgentState, writer: StreamWriter) -> dict[str, Any]:
+        """
+        Modo rápido: sin notas intermedias ni reflexión. Los resultados de todas las búsquedas (sin repetir URLs)
+        van directamente al compilador, que extrae y redacta en una sola llamada en streaming.
+        """
+        writer({"custom_key": " Launching web search (fast mode) ..."})
+        queries = state["queries"]
+        results = await asyncio.gather(*(self._search_one(q) for q in queries))
+        writer({"custom_key": f" Search cache: {search_cache.stats()}"})
+        seen = set()
+        sections = []
+        for query, res in zip(queries, results):
+            if isinstance(res, Exception):
+                writer({"custom_key": f"⚠️ Search failed: {res}"})
+                continue
+            texts = []
+            for r in res['results']:
+                if r.get('url') not in seen:
+                    seen.add(r.get('url'))
+                    texts.append(f"[{r.get('url', '')}]\n{r['content']}")
+            if texts:
+                sections.append(f"### Query: {query}\n" + "\n\n".join(texts))
+        content = "\n\n".join(sections)
+        writer({"custom_key": " Compiling data ..."})
+        if state["extraction_schema"]:
+            prompt = self.fast_compilador_prompt.format(
+                company=state["company"],
+                pending_sections=state['pending_sections'],
+                user_notes=state['user_notes'],
+                schema=state['extraction_schema'],
+                content=content,
+            )
+        else:
+            prompt = self.fast_compilador_prompt_Nsch.format(
+                company=state["company"],
+                instructions=state['user_notes'],
+                content=content,
+            )
+        info_compilada = await astream_text(self.model, prompt, writer, "web")
+        writer({"custom_key": " Report complete - fast mode."})
+        writer({"web_key": f"{info_compilada}"})
+        return {"search_results": content, "info_compilada": info_compilada, "is_complete": True}
 
     async def reflection(self, state: WebAgentState, writer: StreamWriter) -> dict[str, Any]:
+        if low_budget():
+            # Sin tiempo para otra iteración la reflexión no cambiaría nada: se da el informe por bueno
+            writer({"custom_key": " Little time left: skipping reflection."})
+            return {"is_complete": True}
         writer({"custom_key": " Reflecting on data ..."})
         if state["extraction_schema"]:
-            struc = self.model.with_structured_output(Reflection)
+            struc = self.cached_model.with_structured_output(Reflection)
             prompt = self.reflection_prompt.format(
                 schema=state['extraction_schema'],
                 content=state['info_compilada'],
@@ -194,7 +319,7 @@ class WebSearchAgent:
                 user_notes=state['user_notes'],
             )
         else:
-            struc = self.model.with_structured_output(Reflection_Nsch)
+            struc = self.cached_model.with_structured_output(Reflection_Nsch)
             prompt = self.reflection_prompt_Nsch.format(
                 content=state['info_compilada'],
                 instructions=state['user_notes'],
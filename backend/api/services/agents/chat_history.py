@@ -0,0 +1,57 @@
+from langchain.schema import BaseMessage, HumanMessage
+
+from services.agents.context_packer import count_tokens
+
+# Turnos (pregunta + respuesta) que el planificador ve literalmente; los anteriores van al resumen
+HISTORY_TURNS = 3
+# Techo de tokens para el historial que entra en el prompt del planificador (resumen incluido)
+HISTORY_MAX_TOKENS = 3000
+# Un informe largo de un agente no puede ocupar por sí solo todo el historial
+MESSAGE_MAX_TOKENS = 800
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * 4].rstrip() + " [...]"
+
+
+def render_message(message: BaseMessage, max_tokens: int = MESSAGE_MAX_TOKENS) -> str:
+    role = "User" if isinstance(message, HumanMessage) else "Assistant"
+    return f"{role}: {_clip(str(message.content), max_tokens)}"
+
+
+def pending_for_summary(messages: list[BaseMessage], summarized: int, turns: int = HISTORY_TURNS) -> list[BaseMessage]:
+    """Mensajes que ya han salido de la ventana de `turns` turnos y todavía no están en el resumen."""
+    return messages[summarized:max(summarized, len(messages) - 2 * turns)]
+
+
+def history_view(messages: list[BaseMessage], summary: str = "", summarized: int = 0,
+                 turns: int = HISTORY_TURNS, max_tokens: int = HISTORY_MAX_TOKENS) -> str:
+    """
+    Historial acotado para el planificador:
+    - El resumen incremental de los turnos antiguos.
+    - Los últimos `turns` turnos literales (cada mensaje recortado a MESSAGE_MAX_TOKENS).
+    El último mensaje es la pregunta actual, que ya va aparte en el prompt.
+    Si no cabe en `max_tokens` se descartan primero los mensajes más antiguos de la ventana.
+    """
+    previous = messages[:-1]
+    window = previous[max(summarized, len(previous) - 2 * turns):]
+    summary = _clip(summary, max_tokens // 3) if summary else ""
+    budget = max_tokens - (count_tokens(summary) if summary else 0)
+
+    lines: list[str] = []
+    for message in reversed(window):
+        line = render_message(message)
+        cost = count_tokens(line)
+        if cost > budget:
+            break
+        lines.append(line)
+        budget -= cost
+    lines.reverse()
+
+    parts = []
+    if summary:
+        parts.append(f"Summary of earlier conversation: {summary}")
+    parts.extend(lines)
+    return "\n".join(parts) if parts else "(empty)"
@@ -0,0 +1,58 @@
+import os
+
+from langchain.schema import Document
+
+from services.agents.rag_retrieval import chunk_key, relevance_key
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken viene con langchain-openai, pero no es imprescindible
+    tiktoken = None
+
+DEFAULT_CONTEXT_TOKENS = 6000
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens de `text` con el encoding de los modelos de OpenAI; sin tiktoken se estima como len/4."""
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False  # sin red no se puede descargar el encoding
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def render_chunk(doc: Document) -> str:
+    """Solo id, fuente y contenido: el repr del Document con todos sus metadatos gasta tokens sin aportar nada."""
+    source = os.path.basename(str(doc.metadata.get("source", "unknown")))
+    return f"[{doc.metadata.get('id')}] ({source}) {doc.page_content.strip()}"
+
+
+def pack_context(docs: list[Document], max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> tuple[str, list[Document]]:
+    """
+    Prepara los chunks para un prompt:
+    1. Quita los duplicados (mismo chunk_id o mismo contenido normalizado), conservando la primera aparición.
+    2. Los ordena por relevancia (puntuación RRF o distancia; los que no tienen ninguna van al final en su orden).
+    3. Los añade mientras quepan en `max_tokens`; un chunk que no cabe se salta y se prueba con el siguiente.
+    Devuelve el texto y los documentos incluidos.
+    """
+    unique: dict[str, Document] = {}
+    for doc in docs:
+        unique.setdefault(chunk_key(doc), doc)
+    ranked = sorted(unique.values(), key=relevance_key)
+
+    parts, packed = [], []
+    used = 0
+    for doc in ranked:
+        text = render_chunk(doc)
+        tokens = count_tokens(text) + 1  # + separador
+        if used + tokens > max_tokens:
+            continue
+        parts.append(text)
+        packed.append(doc)
+        used += tokens
+    return "\n\n".join(parts), packed
@@ -0,0 +1,35 @@
+import math
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Tiempo máximo de una petición al agente global (segundos)
+REQUEST_TIMEOUT = float(os.getenv("AGENT_REQUEST_TIMEOUT", "240"))
+# Margen que se deja para el informe: por debajo no se empiezan bucles opcionales (reflexiones, nuevas búsquedas)
+REPORT_RESERVE = float(os.getenv("AGENT_REPORT_RESERVE", "45"))
+
+# Instante límite (time.monotonic) de la petición en curso. Al ser un ContextVar lo heredan las tareas
+# que lanza LangGraph para cada nodo y los subgrafos que se ejecutan dentro de ellos.
+_deadline: ContextVar[float | None] = ContextVar("agent_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float | None):
+    """Fija el límite de la petición para todo lo que se ejecute dentro del bloque (None: sin límite)."""
+    token = _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float:
+    """Segundos que le quedan a la petición en curso (infinito si no tiene límite)."""
+    deadline = _deadline.get()
+    return math.inf if deadline is None else deadline - time.monotonic()
+
+
+def low_budget(reserve: float = REPORT_RESERVE) -> bool:
+    """True si ya no queda tiempo para un bucle opcional más sin poner en riesgo el informe."""
+    return remaining() < reserve
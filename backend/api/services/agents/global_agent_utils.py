@@ -94,4 +94,16 @@ Mission:
     3. Give the needed instructions to the agent if used, ensuring they are precise to answer the user's query.
 
 The instructions should be as specific as possible
-"""
\ No newline at end of file
+"""
+
+prompt_history_summary = """
+You keep a running summary of a conversation between a user and a company-analysis assistant.
+Update the current summary with the new messages. Keep the companies, years, figures and conclusions \
+the user may refer to later, and the user's stated preferences. Drop greetings and formatting. \
+Answer only with the updated summary, in at most 200 words.
+
+Current summary: {summary}
+
+New messages:
+{messages}
+"""
@@ -6,20 +6,28 @@ from langchain.schema import BaseMessage, HumanMessage, AIMessage
 from langchain.chains import LLMChain
 from langchain.output_parsers import PydanticOutputParser
 from langchain.prompts import PromptTemplate
+from langchain_core.runnables import RunnableConfig
 
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 import asyncio
 import os
+import uuid
+from contextlib import aclosing, contextmanager
 
 from langgraph.types import StreamWriter
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
 from services.agents.asyncwebsearch import WebAgentState, WebSearchAgent
 from services.agents.web_search_agent_utils import extract_clean_text, ESQUEMA, ESQUEMA_MD
 from services.agents.rag_agents import AgentState, RagAgent
-from services.agents.global_agent_utils import prompt_plan, prompt_final, plan_prompt_rag, plan_prompt_web
+from services.vectorstore_cache import vectorstore_cache
+from services.checkpointer import BoundedCheckpointer
+from services.agents.llm_cache import BoundedLLMCache, with_cache
+from services.agents.global_agent_utils import prompt_plan, prompt_final, plan_prompt_rag, plan_prompt_web, prompt_history_summary
+from services.agents.chat_history import history_view, pending_for_summary, render_message
+from services.agents.token_stream import TOKEN_KEY, chunk_text, token_event, token_start
+from services.agents.deadline import REQUEST_TIMEOUT, deadline_scope
+from services.openai_limiter import priority
 
 # -------------------------------
 # 0. Schema de salida para el plan #@TODO: Quitar defaults
@@ -59,6 +67,11 @@ class GlobalAgentState(TypedDict):
     conversation_id: str 
     schema: str
     company: str
+    # Resumen de los turnos que ya no entran en la ventana del planificador y cuántos mensajes cubre
+    summary: str
+    summarized_messages: int
+    # Modo del agente web en esta petición: "thorough" o "fast" (ver WEB_MODES)
+    web_mode: str
 
 
 
@@ -70,12 +83,23 @@ class GlobalAgent:
         self,
         model: ChatOpenAI,
         reasoning_model: ChatOpenAI,
+        llm_cache: BoundedLLMCache | None = None,
+        checkpointer: BaseCheckpointSaver | None = None,
     ): 
         self.MAX_ITERACIONES = 2
         self.MAX_ITERACIONES_RETRIEVAL = 2
         self.model = model
         self.reasoning_model = reasoning_model
-        self.memory = MemorySaver()
+        # Versiones con cache de respuestas para el planificador
+        self.llm_cache = llm_cache
+        self.cached_model = with_cache(model, llm_cache)
+        self.cached_reasoning_model = with_cache(reasoning_model, llm_cache)
+        # Checkpointer de las conversaciones (por defecto acotado y solo en memoria)
+        self.memory = checkpointer or BoundedCheckpointer()
+        # Resumen del historial en curso por conversación (se lanza al terminar cada turno)
+        self._compactions: dict[str, asyncio.Task] = {}
+        # Expansión de queries y recuperación lanzadas en paralelo al planificador, por (conversación, petición)
+        self._prefetches: dict[tuple[str, str], asyncio.Task] = {}
 
         self.plan_prompt = prompt_plan
         self.final_prompt = prompt_final
@@ -86,10 +110,9 @@ class GlobalAgent:
         # persist_dir = os.path.join(base_dir, "vectorstore_chromadb_automatic")
         # os.makedirs(persist_dir, exist_ok=True)
 
-        embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"), model="text-embedding-3-small")
-        vectorstore = Chroma(persist_directory="./services/agents/vectorstore_chromadb_automatic", embedding_function=embeddings)
+        vectorstore = vectorstore_cache.get()
         # llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0)
-        self.rag_agent = RagAgent(self.model, vectorstore, max_iteraciones=self.MAX_ITERACIONES, max_iteraciones_retrieval=self.MAX_ITERACIONES_RETRIEVAL)
+        self.rag_agent = RagAgent(self.model, vectorstore, max_iteraciones=self.MAX_ITERACIONES, max_iteraciones_retrieval=self.MAX_ITERACIONES_RETRIEVAL, llm_cache=llm_cache)
 
         # Construcción del grafo de estados
         graph = StateGraph(GlobalAgentState)
@@ -102,7 +125,68 @@ class GlobalAgent:
         # Compilar grafo con memoria persistente
         self.graph = graph.compile(checkpointer=self.memory)
 
-    def plan(self, state: GlobalAgentState, writer) -> dict:
+    @contextmanager
+    def use_rag_agent(self):
+        """
+        RagAgent compilado en __init__, apuntando al handle vigente del vectorstore.
+        El handle no se cierra por inactividad mientras dure el bloque.
+        """
+        with vectorstore_cache.use() as vectorstore:
+            self.rag_agent.vectorstore = vectorstore
+            yield self.rag_agent
+
+    async def _prefetch(self, question: str):
+        with self.use_rag_agent() as rag_agent:
+            return await rag_agent.prefetch(question)
+
+    @staticmethod
+    def _prefetch_key(config) -> tuple[str, str]:
+        """
+        Clave del prefetch de una ejecución: dos peticiones simultáneas en la misma conversación
+        no se pisan ni se cancelan el prefetch (run_stream añade request_id a la config).
+        """
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("request_id", "")
+
+    def _start_prefetch(self, key: tuple[str, str], question: str) -> None:
+        """
+        Lanza la expansión de queries y la recuperación del agente RAG sobre el mensaje del usuario sin esperar
+        al planificador: si este elige el agente local, chat() reutiliza el resultado y se ahorra esa ronda.
+        """
+        self._discard_prefetch(key)
+        self._prefetches[key] = asyncio.create_task(self._prefetch(question))
+
+    def _discard_prefetch(self, key: tuple[str, str]) -> None:
+        task = self._prefetches.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    async def _take_prefetch(self, key: tuple[str, str], writer) -> dict:
+        """Campos del prefetch para el estado inicial del RagAgent ({} si no lo hay, ha fallado o se ha cancelado)."""
+        task = self._prefetches.pop(key, None)
+        if task is None:
+            return {}
+        try:
+            prefetched, events = await task
+        except asyncio.CancelledError:
+            # Si la cancelada es esta ejecución se propaga; si solo lo era el prefetch, recuperación normal
+            if asyncio.current_task().cancelling():
+                raise
+            writer({"custom_key": "Prefetch cancelado, se recupera de nuevo."})
+            return {}
+        except Exception as e:
+            writer({"custom_key": f"Prefetch descartado: {e}"})
+            return {}
+        for event in events:
+            writer(event)
+        return prefetched
+
+    async def _ask_planner(self, llm, prompt):
+        # El usuario está esperando al planificador: en el limitador de OpenAI pasa por delante de los agentes
+        with priority("interactive"):
+            return await llm.ainvoke(prompt)
+
+    async def plan(self, state: GlobalAgentState, config: RunnableConfig, writer) -> dict:
         ultimo = state["messages"][-1].content
         historial: List[BaseMessage] = state.get("messages", [])
         # vemos si se llama al agente de rag, web o ambos
@@ -110,14 +194,18 @@ class GlobalAgent:
         rag = state["rag"]
         instructions_rag = ""
         instructions_web = ""
+        prefetch_key = self._prefetch_key(config)
+        # Salvo en modo solo web, el agente local es una opción: su recuperación empieza ya, en paralelo al plan
+        if rag or not web:
+            self._start_prefetch(prefetch_key, ultimo)
                
         if not web:
             prompt = self.plan_prompt_rag.format(
                 query=ultimo,
-                history=historial,
+                history=history_view(historial, state.get("summary", ""), state.get("summarized_messages", 0)),
             )
-            llm = self.model.with_structured_output(HandOffRAG, method="function_calling")
-            result = llm.invoke(prompt)
+            llm = self.cached_model.with_structured_output(HandOffRAG, method="function_calling")
+            result = await self._ask_planner(llm, prompt)
             handoff = cast(HandOffRAG, result)
             # Se añaden los campos para que tenga el mismo formato que HandOff
             web = False
@@ -127,11 +215,11 @@ class GlobalAgent:
         elif not rag:
             prompt = self.plan_prompt_web.format(
                 query=ultimo,
-                history=historial,
+                history=history_view(historial, state.get("summary", ""), state.get("summarized_messages", 0)),
                 schema=state["schema"]
             )
-            llm = self.model.with_structured_output(HandOffWeb, method="function_calling")
-            result = llm.invoke(prompt)
+            llm = self.cached_model.with_structured_output(HandOffWeb, method="function_calling")
+            result = await self._ask_planner(llm, prompt)
             handoff = cast(HandOffWeb, result)
             instructions_rag = ""
             instructions_web = handoff.instructions_web
@@ -141,11 +229,11 @@ class GlobalAgent:
         else:
             prompt = self.plan_prompt.format(
                 query=ultimo,
-                history=historial,
+                history=history_view(historial, state.get("summary", ""), state.get("summarized_messages", 0)),
             )
             # Utilizaremos un modelo razonador para esta primera fase.
-            llm = self.reasoning_model.with_structured_output(HandOff, method="function_calling")
-            result = llm.invoke(prompt)
+            llm = self.cached_reasoning_model.with_structured_output(HandOff, method="function_calling")
+            result = await self._ask_planner(llm, prompt)
             # Reasoning tokens
             handoff = cast(HandOff, result)
             web = handoff.WebAgent
@@ -153,6 +241,8 @@ class GlobalAgent:
             instructions_rag = handoff.instructions_rag
             instructions_web = handoff.instructions_web
 
+        if not rag:
+            self._discard_prefetch(prefetch_key)
 
         writer({"plan_key": f"{web}|||{rag}|||{handoff.response}"})
         print("Intructions RAG:", instructions_rag)
@@ -167,10 +257,11 @@ class GlobalAgent:
             "company":          handoff.company,
         }
 
-    async def chat(self, state: GlobalAgentState, writer) -> dict:
+    async def chat(self, state: GlobalAgentState, config: RunnableConfig, writer) -> dict:
         """
         Nodo principal: recibe el historial, llama al LLM y añade la respuesta al estado.
         """     
+        prefetch_key = self._prefetch_key(config)
         ultimo_mensaje = state["messages"][-1].content
         historial: List[BaseMessage] = state.get("messages", [])
 
@@ -185,12 +276,13 @@ class GlobalAgent:
         response = state["response"]
         company = state["company"]
         schema = state["schema"]
+        web_mode = state.get("web_mode") or "thorough"
         if web and rag:
             writer({"custom_key": "Lanzando ambos agentes en paralelo..."})
 
             # 1) Define la coroutine para Web Search
             async def run_web() -> str:
-                web_agent = WebSearchAgent(self.model)
+                web_agent = WebSearchAgent(self.model, llm_cache=self.llm_cache, mode=web_mode)
                 sections = "description,history,business,market,people,capital_allocation" if schema else ""
                 state_web = WebAgentState(
                     company=company,
@@ -226,19 +318,21 @@ class GlobalAgent:
                     "iterations_retrieval": 0,
                     "has_relevant_docs": False,
                     "is_complete": False,
+                    **await self._take_prefetch(prefetch_key, writer),
                 }
                 final_rag = None
-                async for chunk in self.rag_agent.graph.astream(state_rag, {}, stream_mode="custom"):
-                    if chunk.get("final_key"):
-                        final_rag = chunk["final_key"]
+                with self.use_rag_agent() as rag_agent:
+                    async for chunk in rag_agent.graph.astream(state_rag, {}, stream_mode="custom"):
+                        if chunk.get("final_key"):
+                            final_rag = chunk["final_key"]
                 # final_rag ya es un string con la respuesta del RAG
                 return final_rag or "No se obtuvo respuesta del agente RAG"
 
-            # 3) Ejecuta ambas en paralelo
-            res_web, res_rag = await asyncio.gather(
-                run_web(),
-                run_rag(),
-            )
+            # 3) Ejecuta ambas en paralelo; si una falla o se cancela la petición, se cancela también la otra
+            async with asyncio.TaskGroup() as group:
+                task_web = group.create_task(run_web())
+                task_rag = group.create_task(run_rag())
+            res_web, res_rag = task_web.result(), task_rag.result()
             print("🌐res_web:", res_web)
             print("🔍res_rag:", res_rag)
             # 4) Combina las dos salidas en un único AIMessage
@@ -260,7 +354,7 @@ class GlobalAgent:
             
             writer({"custom_key": f"--- Mensajes hasta el momento : {state['messages']}"})
             async def main(llm, company: str = "Apple", schema: str = ESQUEMA_MD, instructions: str = "") -> str:
-                web_agent = WebSearchAgent(llm)
+                web_agent = WebSearchAgent(llm, llm_cache=self.llm_cache, mode=web_mode)
 
                 state = WebAgentState(
                     company=company,
@@ -303,39 +397,38 @@ class GlobalAgent:
             #res_rag = await self.rag_agent.run(instructions_rag)
             res_rag = "No se obtuvo respuesta del agente RAG"
 
-            embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"), model="text-embedding-3-small")
-            vectorstore = Chroma(persist_directory="services/agents/vectorstore_chromadb_automatic", embedding_function=embeddings)
+            async def run(question: str) -> str:
+                # Se reutiliza el RagAgent ya compilado, con el handle del vectorstore cacheado
+                with self.use_rag_agent() as rag_agent:
+                    # Estado inicial
+                    state: AgentState = {
+                        "user_question": question,
+                        "messages": [],
+                        "queries": [],
+                        "retrieved_docs": [],
+                        "relevant_docs": [],
+                        "docs_reflection": [],
+                        "report_reflection": [],
+                        "thoughts": [],
+                        "response": "",
+                        "iterations": 0,
+                        "iterations_retrieval": 0,
+                        "has_relevant_docs": False,
+                        "is_complete": False,
+                        **await self._take_prefetch(prefetch_key, writer),
+                    }
+                    # Ejecutar grafo de forma async
+                    async for chunk in rag_agent.graph.astream(state, stream_mode="custom"):
 
-            async def run(question: str, model, vectorstore, max_iteraciones: int = 1, max_iteraciones_retrieval: int = 1) -> str:
-                rag_agent = RagAgent(model, vectorstore, max_iteraciones=max_iteraciones, max_iteraciones_retrieval=max_iteraciones_retrieval)
-                # Estado inicial
-                state: AgentState = {
-                    "user_question": question,
-                    "messages": [],
-                    "queries": [],
-                    "retrieved_docs": [],
-                    "relevant_docs": [],
-                    "docs_reflection": [],
-                    "report_reflection": [],
-                    "thoughts": [],
-                    "response": "",
-                    "iterations": 0,
-                    "iterations_retrieval": 0,
-                    "has_relevant_docs": False,
-                    "is_complete": False,
-                }
-                # Ejecutar grafo de forma async
-                async for chunk in rag_agent.graph.astream(state, stream_mode="custom"):
-
-                    # print(chunk)
-                    if chunk.get("rag_key"):
-                        print("🔍 FINAL KEY OBTAINED IN RAG")
-                        res = chunk["rag_key"]
-                        return res
-                        #return chunk
-                #return state["response"]
-                return "Error: No se pudo generar una respuesta completa."
-            res_rag = await run(instructions_rag, self.model, vectorstore, max_iteraciones=self.MAX_ITERACIONES, max_iteraciones_retrieval=self.MAX_ITERACIONES_RETRIEVAL)
+                        # print(chunk)
+                        if chunk.get("rag_key"):
+                            print("🔍 FINAL KEY OBTAINED IN RAG")
+                            res = chunk["rag_key"]
+                            return res
+                            #return chunk
+                    #return state["response"]
+                    return "Error: No se pudo generar una respuesta completa."
+            res_rag = await run(instructions_rag)
             res_rag = AIMessage(content=res_rag)  
             if res_rag is None:
                 res_rag = AIMessage(content="No se obtuvo respuesta del agente RAG.")
@@ -358,7 +451,25 @@ class GlobalAgent:
         # historial.append(combinado)
         
     
-    async def run(self, question: str, config: dict, schema: str, rag_only=False, web_only=False) -> str:
+    async def run(self, question: str, config: dict, schema: str, rag_only=False, web_only=False,
+                  timeout: float | None = REQUEST_TIMEOUT, web_mode: str = "thorough") -> str:
+        final_result = None
+        async for event in self.run_stream(question, config, schema, rag_only, web_only, timeout, web_mode):
+            if event.get("final_key") is not None:
+                final_result = event["final_key"]
+        return final_result
+
+    async def run_stream(self, question: str, config: dict, schema: str, rag_only=False, web_only=False,
+                         timeout: float | None = REQUEST_TIMEOUT, web_mode: str = "thorough"):
+        """
+        Igual que run() pero va devolviendo los eventos del grafo (custom_key, plan_key, rag_key, web_key)
+        según se producen. El último evento es {"final_key": respuesta}.
+        La petición tiene `timeout` segundos: al acercarse el límite los agentes se saltan las reflexiones
+        y búsquedas opcionales, y al agotarse se cancela el grafo y se lanza TimeoutError.
+        Si quien consume el stream lo cierra (cliente desconectado), se cancelan los nodos y subagentes en curso.
+        `web_mode` elige el grafo del agente web: "thorough" (notas, compilación y reflexión) o "fast"
+        (una sola llamada de compilación sobre los resultados de búsqueda).
+        """
         # Estado inicial
         state: GlobalAgentState = {
             "messages": [ HumanMessage(content=question) ],
@@ -370,82 +481,120 @@ class GlobalAgent:
             "conversation_id": "",
             "schema": schema,
             "company":"",
+            "web_mode": web_mode,
         }
+        thread_id = config["configurable"]["thread_id"]
+        # Id de esta ejecución, para separar su prefetch del de otras peticiones simultáneas en la conversación
+        config = {**config, "configurable": {**config["configurable"], "request_id": uuid.uuid4().hex}}
+        pending = self._compactions.get(thread_id)
+        if pending is not None:
+            await asyncio.shield(pending)
         rag_chunk = ""
         web_chunk = ""
-        async for chunk in self.graph.astream(state, config, stream_mode="custom"):
-            print("🔍 CHUNK in global:", chunk)
-
-            if chunk.get("plan_key"):
-                print("🔍 PLAN KEY OBTAINED IN Global agent")
-                plan = chunk["plan_key"]
-                web, rag, response = plan.split("|||")
-                web = web == "True"
-                rag = rag == "True"
-
-            if web and rag:
-                print("🔍 BOTH AGENTS SELECTED")
-                if chunk.get("web_key"):
-                    web_chunk = chunk["web_key"]
-                    # Detectar si hace falta usar extract_clean_text() por el formato
-                    if web_chunk.startswith("```") or "<schema_to_complete>" in web_chunk:
-                        web_chunk = extract_clean_text(web_chunk)
-                if chunk.get("rag_key"):
-                    rag_chunk = chunk["rag_key"]
-                
-                if rag_chunk != "" and web_chunk != "":
-                    print(
-                        f"🔍 Local database Agent (RAG):\n{rag_chunk}\n\n"
-                        f"🌐 Web search Agent:\n{web_chunk}"
-                )
-                    response_final = f"🔍 Local database Agent (RAG):\n{rag_chunk}\n\n 🌐 Web search Agent:\n{web_chunk}"
-
-                    prompt_res = self.final_prompt.format(
-                        query=question,
-                        rag_chunk=rag_chunk,
-                        web_chunk=web_chunk,
-                    )
-                    result = self.model.invoke(prompt_res)
-                    if isinstance(result, AIMessage):
-                        final_result = result.content
-                    else:
-                        final_result = result
-                    if final_result.startswith("```") or "<schema_to_complete>" in final_result:
-                        final_result = extract_clean_text(final_result)
-                    print("🔍🌐 FINAL RESULT:", final_result)
-                    self.graph.update_state(config, {"messages": [AIMessage(content=final_result)]})
-                    if final_result is None:
-                        final_result = "No se obtuvo respuesta final."
-                    return final_result
-
-            elif web:
-                print("🔍 WEB AGENT SELECTED")
-                if chunk.get("web_key"):
-                    final_chunk = chunk["web_key"]
-                    if final_chunk.startswith("```") or "<schema_to_complete>" in final_chunk:
-                        final_chunk = extract_clean_text(final_chunk)
-                    if final_chunk is None:
-                        final_chunk = "No se obtuvo respuesta del agente Web."
-                    self.graph.update_state(config, {"messages": [AIMessage(content=final_chunk)]})
-                    return final_chunk
-            elif rag:
-                print("🔍 RAG AGENT SELECTED")
-                if chunk.get("rag_key"):
-                    final_chunk = chunk["rag_key"]
-                    if final_chunk.startswith("```") or "<schema_to_complete>" in final_chunk:
-                        final_chunk = extract_clean_text(final_chunk)
-                    # Detectar si hace falta usar extract_clean_text() por el formato
-                    print("🔍 FINAL KEY CHUNK:", final_chunk)
-                    if final_chunk is None:
-                        final_chunk = "No se obtuvo respuesta del agente RAG."
-                    self.graph.update_state(config, {"messages": [AIMessage(content=final_chunk)]})
-                    return final_chunk
-            else:
-                print("🔍 NO AGENT SELECTED")
-                if response is None:
-                    response = "No se obtuvo respuesta."
-                self.graph.update_state(config, {"messages": [AIMessage(content=response)]})
-                return response
+        final_result = None
+        # Límite duro de la petición: al agotarse se cancela el grafo con todo lo que tenga en curso
+        limit = asyncio.timeout(timeout)
+        try:
+            with deadline_scope(timeout):
+                async with limit, aclosing(self.graph.astream(state, config, stream_mode="custom")) as stream:
+                    async for chunk in stream:
+                        if not chunk.get(TOKEN_KEY):
+                            print("🔍 CHUNK in global:", chunk)
+                        yield chunk
+
+                        if chunk.get("plan_key"):
+                            print("🔍 PLAN KEY OBTAINED IN Global agent")
+                            plan = chunk["plan_key"]
+                            web, rag, response = plan.split("|||")
+                            web = web == "True"
+                            rag = rag == "True"
+
+                        if web and rag:
+                            print("🔍 BOTH AGENTS SELECTED")
+                            if chunk.get("web_key"):
+                                web_chunk = chunk["web_key"]
+                                # Detectar si hace falta usar extract_clean_text() por el formato
+                                if web_chunk.startswith("```") or "<schema_to_complete>" in web_chunk:
+                                    web_chunk = extract_clean_text(web_chunk)
+                            if chunk.get("rag_key"):
+                                rag_chunk = chunk["rag_key"]
+
+                            if rag_chunk != "" and web_chunk != "":
+                                print(
+                                    f"🔍 Local database Agent (RAG):\n{rag_chunk}\n\n"
+                                    f"🌐 Web search Agent:\n{web_chunk}"
+                            )
+                                yield {"custom_key": "Generating final answer from both reports..."}
+                                prompt_res = self.final_prompt.format(
+                                    query=question,
+                                    rag_chunk=rag_chunk,
+                                    web_chunk=web_chunk,
+                                )
+                                # La síntesis se emite según se escribe; la versión limpia llega en final_key
+                                attempt, start = token_start("final")
+                                yield start
+                                parts = []
+                                async for piece in self.model.astream(prompt_res):
+                                    text = chunk_text(piece)
+                                    if text:
+                                        parts.append(text)
+                                        yield token_event("final", text, attempt)
+                                final_result = "".join(parts)
+                                if final_result.startswith("```") or "<schema_to_complete>" in final_result:
+                                    final_result = extract_clean_text(final_result)
+                                print("🔍🌐 FINAL RESULT:", final_result)
+                                if final_result is None:
+                                    final_result = "No se obtuvo respuesta final."
+                                break
+
+                        elif web:
+                            print("🔍 WEB AGENT SELECTED")
+                            if chunk.get("web_key"):
+                                final_result = chunk["web_key"]
+                                if final_result.startswith("```") or "<schema_to_complete>" in final_result:
+                                    final_result = extract_clean_text(final_result)
+                                if final_result is None:
+                                    final_result = "No se obtuvo respuesta del agente Web."
+                                break
+                        elif rag:
+                            print("🔍 RAG AGENT SELECTED")
+                            if chunk.get("rag_key"):
+                                final_result = chunk["rag_key"]
+                                # Detectar si hace falta usar extract_clean_text() por el formato
+                                if final_result.startswith("```") or "<schema_to_complete>" in final_result:
+                                    final_result = extract_clean_text(final_result)
+                                print("🔍 FINAL KEY CHUNK:", final_result)
+                                if final_result is None:
+                                    final_result = "No se obtuvo respuesta del agente RAG."
+                                break
+                        else:
+                            print("🔍 NO AGENT SELECTED")
+                            final_result = response
+                            if final_result is None:
+                                final_result = "No se obtuvo respuesta."
+                            break
+        except TimeoutError:
+            if not limit.expired():
+                raise
+            raise TimeoutError(f"La petición ha superado el tiempo máximo de {timeout:g} s.") from None
+        finally:
+            # El planificador ha descartado el agente local o el stream se ha cortado antes de chat()
+            self._discard_prefetch(self._prefetch_key(config))
+
+        if final_result is None:
+            return
+        # El grafo se ha cerrado antes de terminar, guardamos la respuesta en memoria para futuros mensajes
+        await self.graph.aupdate_state(config, {"messages": [AIMessage(content=final_result)]})
+        # El resumen de los turnos que salen de la ventana se actualiza fuera del camino crítico
+        task = asyncio.create_task(self._compact_history(config))
+        self._compactions[thread_id] = task
+
+        def _forget(done: asyncio.Task) -> None:
+            if self._compactions.get(thread_id) is done:
+                del self._compactions[thread_id]
+
+        task.add_done_callback(_forget)
+        yield {"final_key": final_result}
         """
         async for chunk in self.graph.astream(state, config, stream_mode="custom"):
             print("🔍 CHUNK in global:", chunk)
@@ -466,6 +615,24 @@ class GlobalAgent:
         
         return res
         """
+
+    async def _compact_history(self, config: dict) -> None:
+        """Añade al resumen de la conversación los mensajes que han salido de la ventana del planificador."""
+        try:
+            values = (await self.graph.aget_state(config)).values
+            summarized = values.get("summarized_messages", 0)
+            pending = pending_for_summary(values.get("messages", []), summarized)
+            if not pending:
+                return
+            prompt = prompt_history_summary.format(
+                summary=values.get("summary", "") or "(empty)",
+                messages="\n".join(render_message(m) for m in pending),
+            )
+            result = await self.model.ainvoke(prompt)
+            await self.graph.aupdate_state(config, {"summary": result.content, "summarized_messages": summarized + len(pending)})
+        except Exception as e:
+            print(f"[history] could not update the summary: {e}")
+
 if __name__ == "__main__":
     import os
     openai_api_key = os.getenv("OPENAI_API_KEY")
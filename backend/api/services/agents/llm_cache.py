@@ -0,0 +1,78 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from langchain_core.caches import BaseCache
+
+
+class BoundedLLMCache(BaseCache):
+    """
+    Cache exacta de respuestas de LLM con expulsión LRU.
+    LangChain la consulta con (prompt, llm_string); llm_string ya incluye el modelo, sus parámetros
+    (temperatura, max_tokens...) y las tools/response_format del structured output, así que la clave
+    es el hash de ambos.
+    Solo se usa en los nodos que lo piden explícitamente (ver with_cache).
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str):
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            self._entries[key] = return_val
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    # Las operaciones son en memoria: no hace falta pasar por un executor como en BaseCache
+    async def alookup(self, prompt: str, llm_string: str):
+        return self.lookup(prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val) -> None:
+        self.update(prompt, llm_string, return_val)
+
+    async def aclear(self, **kwargs) -> None:
+        self.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+def with_cache(model, cache: BaseCache | None):
+    """
+    Copia del modelo que consulta `cache` antes de llamar a la API. Comparte los clientes HTTP
+    con el modelo original. Sin cache devuelve el mismo modelo.
+    """
+    if cache is None:
+        return model
+    return model.model_copy(update={"cache": cache})
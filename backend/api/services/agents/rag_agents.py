@@ -1,6 +1,8 @@
 import os
 import time
 import asyncio
+import threading
+from collections import Counter, deque
 from typing import Annotated, Any, List, cast
 
 from typing_extensions import TypedDict
@@ -30,6 +32,12 @@ from services.agents.rag_agent_utils import (
     ReflectionCompleteness,
     Queries,
 )
+from services.agents.rag_retrieval import batched_search, calibrate_thresholds, chunk_key, triage_by_similarity
+from services.agents.llm_cache import with_cache
+from services.agents.context_packer import DEFAULT_CONTEXT_TOKENS, pack_context
+from services.agents.token_stream import astream_text
+from services.agents.deadline import low_budget
+from services.lexical_index import get_lexical_index
 
 # -------------------------------
 # 1. Definición del estado del agente
@@ -48,6 +56,10 @@ class AgentState(TypedDict):
     iterations: int
     has_relevant_docs: bool
     is_complete: bool
+    # Chunks recuperados antes de arrancar el grafo (prefetch especulativo), sin ids: los adopta el nodo retrieval
+    prefetched_docs: List[Any]
+    # chunk_key de los docs ya juzgados en pasadas anteriores de reflection_docs
+    judged_docs: List[str]
 
 # -------------------------------
 # 2. Agent RAG Async
@@ -59,11 +71,33 @@ class RagAgent:
         vectorstore: Chroma,
         max_iteraciones: int = 1,
         max_iteraciones_retrieval: int = 1,
+        llm_cache=None,
+        context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+        retrieval_mode: str = "similarity",
+        max_k: int | None = 6,
+        reject_below: float = 0.25,
+        accept_from: float = 0.6,
     ):
         self.model = model
+        # Modelo con cache de respuestas para los nodos deterministas (expansión de queries y reflexiones)
+        self.cached_model = with_cache(model, llm_cache)
         self.vectorstore = vectorstore
         self.max_iteraciones = max_iteraciones
         self.max_iteraciones_retrieval = max_iteraciones_retrieval
+        # Presupuesto de tokens para los documentos que se meten en los prompts
+        self.context_tokens = context_tokens
+        # "similarity" (k vecinos por query) o "mmr" (selección diversa entre los candidatos de todas las queries)
+        self.retrieval_mode = retrieval_mode
+        # Hasta cuántos chunks por query con top-k adaptativo (None: siempre k=3)
+        self.max_k = max_k
+        # Umbrales de similitud coseno: por encima de accept_from el chunk es relevante y por debajo de reject_below
+        # no lo es, sin preguntar al LLM; solo la franja intermedia pasa por reflection_docs. Puntos de partida
+        # conservadores para text-embedding-3-small que se van ajustando con los veredictos del LLM (recalibrate)
+        self.reject_below = reject_below
+        self.accept_from = accept_from
+        self._verdicts: deque[tuple[float, bool]] = deque(maxlen=2000)
+        self._triage = Counter()
+        self._triage_lock = threading.RLock()
         self.memory = MemorySaver()  # Instancia de checkpointer
 
 
@@ -89,9 +123,28 @@ class RagAgent:
             {True: END, False: "query_expansion"},
         )
 
-        graph.set_entry_point("query_expansion")
+        # Si llegan queries y chunks ya recuperados (prefetch), se empieza directamente por retrieval
+        graph.set_conditional_entry_point(
+            self.entry_point,
+            {"query_expansion": "query_expansion", "retrieval": "retrieval"},
+        )
         self.graph = graph.compile()
 
+    def entry_point(self, state: AgentState) -> str:
+        return "retrieval" if state.get("prefetched_docs") else "query_expansion"
+
+    async def prefetch(self, question: str) -> tuple[dict[str, Any], list[dict]]:
+        """
+        Expansión de queries y búsqueda sobre `question` fuera del grafo, para lanzarlas de forma especulativa
+        mientras el planificador decide. Devuelve los campos que se añaden al estado inicial del grafo
+        (queries y prefetched_docs) y los eventos emitidos, para reenviarlos si se usa el resultado.
+        """
+        events: list[dict] = []
+        state = {"user_question": question, "iterations_retrieval": 0, "queries": [], "thoughts": []}
+        result = await self.query_expansion(state, events.append)
+        documentos = await self._search(result["queries"], events.append)
+        return {"queries": result["queries"], "prefetched_docs": documentos}, events
+
     async def query_expansion(self, state: AgentState, writer: StreamWriter) -> dict[str, Any]:
         writer({"custom_key": f"Generando queries (iterRetrieval={state['iterations_retrieval'] + 1})..."})
         
@@ -107,71 +160,141 @@ class RagAgent:
             )
 
         # Llamada async al LLM con structured output
-        llm = self.model.with_structured_output(Queries, method="function_calling")
+        llm = self.cached_model.with_structured_output(Queries, method="function_calling")
         result = await llm.ainvoke(prompt)
         queries = cast(Queries, result).queries
         state["queries"] = queries
         writer({"custom_key": f"Queries generadas: {queries}"})
         return {"queries": queries}
 
-    async def retrieval(self, state: AgentState, writer: StreamWriter) -> None:
+    async def retrieval(self, state: AgentState, writer: StreamWriter) -> dict[str, Any]:
         writer({"custom_key": f"Recuperando docs iterRetrieval={state['iterations_retrieval'] + 1}..."})
-        documentos = []
-        
-        for q in state["queries"]:
-            years_in_query = re.findall(r'\b(?:19|20)\d{2}\b', q)
-            if years_in_query:
-                filtro_year = years_in_query[0]
-                writer({"custom_key": f"Aplicando filtro year={filtro_year} para la query: '{q[:50]}...'"})
-                docs = await asyncio.to_thread(
-                    self.vectorstore.similarity_search,
-                    q,
-                    3,
-                    {"year": filtro_year}  # aquí el filtro
-                )
-            else:
-                docs = await asyncio.to_thread(self.vectorstore.similarity_search, q, 3)
-            documentos.extend(docs)
-        ided = id_agregator(documentos, (state["iterations"] + state["iterations_retrieval"]) * 10 + 1)
+        if state.get("prefetched_docs"):
+            documentos = state["prefetched_docs"]
+            writer({"custom_key": f"Usando {len(documentos)} docs recuperados mientras se planificaba."})
+        else:
+            documentos = await self._search(state["queries"], writer)
+        # Los chunks ya recuperados en iteraciones anteriores no se vuelven a añadir
+        vistos = {chunk_key(doc) for doc in state["retrieved_docs"]}
+        nuevos = [doc for doc in documentos if chunk_key(doc) not in vistos]
+        siguiente_id = max((doc.metadata.get("id", 0) for doc in state["retrieved_docs"]), default=0) + 1
+        ided = id_agregator(nuevos, siguiente_id)
         state["retrieved_docs"].extend(ided)
-        writer({"custom_key": f"Retrieved {len(ided)} documents."})
+        writer({"custom_key": f"Retrieved {len(ided)} new documents ({len(documentos) - len(nuevos)} already seen)."})
         for doc in ided:
             writer({"custom_key": f"Retrieved {str(doc)[:200]}..."})
-        return {}
+        return {"prefetched_docs": []}
+
+    async def _search(self, queries: list[str], writer) -> list:
+        # Un solo embedding para todas las queries y una consulta a la colección por filtro de año
+        # Búsqueda híbrida: vectorial + BM25 (cifras, tickers y términos exactos), fusionadas con RRF
+        return await batched_search(
+            self.vectorstore, queries, k=3, writer=writer, mode=self.retrieval_mode,
+            lexical_index=get_lexical_index(), max_k=self.max_k,
+        )
 
     async def reflection_docs(self, state: AgentState, writer: StreamWriter) -> dict[str, Any]:
         writer({"custom_key": "Reflexionando sobre docs recuperados..."})
-        prompt = REFLECTION_DOCS_PROMPT.format(
-            user_input=state["user_question"],
-            retrieved_documents=state["retrieved_docs"],
-        )
-        llm = self.model.with_structured_output(ReflectionDocs, method="function_calling")
-        result = await llm.ainvoke(prompt)
-        filtered = filtrar_documentos_por_ids(result.id_relevant_docs, state["retrieved_docs"])
+        # Solo los docs nuevos de esta pasada: los de pasadas anteriores ya están aceptados o descartados
+        judged = set(state.get("judged_docs") or [])
+        new_docs = [doc for doc in state["retrieved_docs"] if chunk_key(doc) not in judged]
+        # Los chunks claramente relevantes o irrelevantes por similitud no necesitan al LLM
+        accepted, ambiguous, rejected = triage_by_similarity(new_docs, self.reject_below, self.accept_from)
+        writer({"custom_key": f"Por similitud: {len(accepted)} aceptados, {len(rejected)} descartados, {len(ambiguous)} dudosos."})
+        chosen = []
+        if ambiguous:
+            context, packed = pack_context(ambiguous, self.context_tokens)
+            writer({"custom_key": f"Contexto: {len(packed)} de {len(ambiguous)} docs dudosos."})
+            prompt = REFLECTION_DOCS_PROMPT.format(
+                user_input=state["user_question"],
+                retrieved_documents=context,
+            )
+            llm = self.cached_model.with_structured_output(ReflectionDocs, method="function_calling")
+            result = await llm.ainvoke(prompt)
+            chosen = filtrar_documentos_por_ids(result.id_relevant_docs, ambiguous)
+            thoughts = result.thoughts
+            self._record_verdicts(packed, chosen)
+        elif accepted:
+            thoughts = ""
+        else:
+            thoughts = "None of the retrieved chunks is close to the question: try other keywords, metrics or years."
+        self._count(accepted, ambiguous, rejected, llm_called=bool(ambiguous))
+        relevant = {chunk_key(doc) for doc in state["relevant_docs"]}
+        filtered = [doc for doc in accepted + chosen if chunk_key(doc) not in relevant]
         state["relevant_docs"].extend(filtered)
         has = len(filtered) > 0
-        return {"has_relevant_docs": has, "thoughts": result.thoughts, "iterations_retrieval": state["iterations_retrieval"] + 1}
+        return {
+            "has_relevant_docs": has,
+            "thoughts": thoughts,
+            "iterations_retrieval": state["iterations_retrieval"] + 1,
+            "judged_docs": sorted(judged | {chunk_key(doc) for doc in new_docs}),
+        }
+
+    def _count(self, accepted, ambiguous, rejected, llm_called: bool) -> None:
+        with self._triage_lock:
+            self._triage["accepted"] += len(accepted)
+            self._triage["rejected"] += len(rejected)
+            self._triage["ambiguous"] += len(ambiguous)
+            self._triage["reflection_calls" if llm_called else "reflection_calls_avoided"] += 1
+
+    def _record_verdicts(self, judged, chosen) -> None:
+        """Guarda (similitud, relevante) de los chunks que ha juzgado el LLM y recalibra cada 100 veredictos."""
+        chosen_keys = {chunk_key(doc) for doc in chosen}
+        with self._triage_lock:
+            for doc in judged:
+                if doc.metadata.get("similarity") is not None:
+                    self._verdicts.append((doc.metadata["similarity"], chunk_key(doc) in chosen_keys))
+                    self._triage["verdicts"] += 1
+                    if self._triage["verdicts"] % 100 == 0:
+                        self.recalibrate()
+
+    def recalibrate(self) -> None:
+        """Acerca los umbrales de aceptación y descarte según los veredictos del LLM (ver calibrate_thresholds)."""
+        with self._triage_lock:
+            self.reject_below, self.accept_from = calibrate_thresholds(self._verdicts, self.reject_below, self.accept_from)
+
+    def relevance_stats(self) -> dict:
+        """Chunks resueltos por similitud y llamadas a reflection_docs evitadas."""
+        with self._triage_lock:
+            calls = self._triage["reflection_calls"] + self._triage["reflection_calls_avoided"]
+            return {
+                **self._triage,
+                "avoided_ratio": round(self._triage["reflection_calls_avoided"] / calls, 3) if calls else 0.0,
+                "reject_below": round(self.reject_below, 3),
+                "accept_from": round(self.accept_from, 3),
+            }
 
     def conditional_reflection_docs(self, state: AgentState, writer: StreamWriter) -> bool:
-        return state["has_relevant_docs"] or state["iterations_retrieval"] >= self.max_iteraciones_retrieval
+        if state["has_relevant_docs"] or state["iterations_retrieval"] >= self.max_iteraciones_retrieval:
+            return True
+        if low_budget():
+            writer({"custom_key": "Poco tiempo restante: se genera el informe sin otra búsqueda."})
+            return True
+        return False
 
     async def generation(self, state: AgentState, writer: StreamWriter) -> dict[str, Any]:
         writer({"custom_key": "Generating report..."})
+        context, _ = pack_context(state["relevant_docs"], self.context_tokens)
         prompt = REPORT_GENERATION_PROMPT.format(
             user_input=state["user_question"],
-            retrieved_documents=state["relevant_docs"],
+            retrieved_documents=context,
         )
-        resp = await self.model.ainvoke(prompt)
-        state["response"] = resp.content
-        return {"response": resp.content}
+        # El informe se emite según se escribe (token_key); el completo sigue llegando en rag_key
+        response = await astream_text(self.model, prompt, writer, "rag")
+        state["response"] = response
+        return {"response": response}
 
     async def reflection_completeness(self, state: AgentState, writer: StreamWriter) -> dict[str, Any]:
+        if low_budget():
+            # Sin tiempo para otra vuelta la reflexión no cambiaría nada: se da el informe por bueno
+            writer({"custom_key": "Poco tiempo restante: se omite la verificación de completitud."})
+            return {"is_complete": True, "iterations": state["iterations"] + 1}
         writer({"custom_key": "Verificando completitud..."})
         prompt = REFLECTION_COMPLETENESS_PROMPT.format(
             user_input=state["user_question"],
             generated_report=state["response"],
         )
-        llm = self.model.with_structured_output(ReflectionCompleteness, method="function_calling")
+        llm = self.cached_model.with_structured_output(ReflectionCompleteness, method="function_calling")
         result = await llm.ainvoke(prompt)
         state["is_complete"] = result.is_complete
         return {"is_complete": result.is_complete, "thoughts": result.thoughts, "iterations": state["iterations"] + 1}
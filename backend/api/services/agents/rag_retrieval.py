@@ -0,0 +1,376 @@
+import asyncio
+import hashlib
+import re
+
+import numpy as np
+from langchain.schema import Document
+
+YEAR_PATTERN = re.compile(r'\b(?:19|20)\d{2}\b')
+_NON_WORD = re.compile(r'[^\w\s]')
+_SPACES = re.compile(r'\s+')
+# Palabras de los nombres de fichero que no sirven para saber a qué documento se refiere una query
+_GENERIC_NAME_WORDS = frozenset(
+    "annual anual report reports informe informes cuentas accounts results resultados financial financiero "
+    "financieros presentation presentacion consolidated consolidadas memoria esp eng pdf final".split()
+)
+
+
+def normalize_query(query: str) -> str:
+    """Minúsculas, sin signos de puntuación y con espacios colapsados."""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", query.lower())).strip()
+
+
+def dedupe_queries(queries: list[str], vectors: np.ndarray, threshold: float = 0.95) -> list[int]:
+    """
+    Devuelve los índices de las queries a conservar: descarta las repetidas tras normalizar
+    y las casi duplicadas (similitud coseno >= threshold con una query ya conservada).
+    Dos queries con distintos años nunca se consideran duplicadas, porque se filtran distinto.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms == 0, 1, norms)
+    sims = unit @ unit.T
+    keep: list[int] = []
+    seen_text = set()
+    for i, q in enumerate(queries):
+        text = normalize_query(q)
+        if text in seen_text:
+            continue
+        years = query_years(q)
+        if any(sims[i, j] >= threshold and query_years(queries[j]) == years for j in keep):
+            continue
+        seen_text.add(text)
+        keep.append(i)
+    return keep
+
+
+def query_years(query: str) -> tuple[str, ...]:
+    """Todos los años mencionados en la query (se usan como filtro de metadatos)."""
+    return tuple(sorted(set(YEAR_PATTERN.findall(query))))
+
+
+def _name_words(name: str) -> set[str]:
+    stem = name.rsplit(".", 1)[0]
+    return {w for w in normalize_query(stem.replace("_", " ")).split() if len(w) >= 4 and not w.isdigit()} - _GENERIC_NAME_WORDS
+
+
+def source_hints(query: str, sources) -> tuple[str, ...]:
+    """
+    Ficheros a los que apunta la query: los que comparten con ella una palabra distintiva del nombre
+    (no genérica y que no aparece en todos los ficheros). Sin pistas claras no se filtra por fichero.
+    """
+    sources = list(sources)
+    if len(sources) < 2:
+        return ()
+    words = {source: _name_words(source) for source in sources}
+    common = set.intersection(*words.values())
+    query_words = set(normalize_query(query).split())
+    return tuple(sorted(source for source in sources if (words[source] - common) & query_words))
+
+
+def build_where(years: tuple[str, ...], sources: tuple[str, ...]) -> dict | None:
+    """
+    Filtro de metadatos de Chroma:
+    - Años: el del nombre del fichero está en `years` ($in) o el contenido menciona alguno (marcas year_XXXX).
+    - Ficheros: source $in `sources`.
+    Ambas condiciones se combinan con $and.
+    """
+    clauses = []
+    if years:
+        year_clauses = [{"year": {"$in": list(years)}}] + [{f"year_{y}": {"$eq": True}} for y in years]
+        clauses.append({"$or": year_clauses})
+    if sources:
+        clauses.append({"source": {"$in": list(sources)}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def chunk_key(doc: Document) -> str:
+    """Identidad de un chunk: su chunk_id de la ingesta o, si no lo tiene, el hash de su contenido normalizado."""
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id:
+        return chunk_id
+    return hashlib.sha1(normalize_query(doc.page_content).encode("utf-8")).hexdigest()
+
+
+def relevance_key(doc: Document) -> float:
+    """Orden de relevancia (menor es mejor): la puntuación RRF si la búsqueda fue híbrida, si no la distancia."""
+    if doc.metadata.get("score") is not None:
+        return -doc.metadata["score"]
+    distance = doc.metadata.get("distance")
+    return float("inf") if distance is None else distance
+
+
+def collection_space(collection) -> str:
+    """Métrica de distancia de la colección de Chroma ("l2" por defecto, "cosine" o "ip")."""
+    configuration = getattr(collection, "configuration", None) or {}
+    space = (configuration.get("hnsw") or {}).get("space")
+    return space or (collection.metadata or {}).get("hnsw:space", "l2")
+
+
+def distance_to_similarity(distance: float, space: str = "l2") -> float:
+    """
+    Similitud coseno a partir de la distancia que devuelve Chroma. Con "l2" (euclídea al cuadrado) e "ip"
+    se asume que los embeddings están normalizados, como los de OpenAI.
+    """
+    if space == "l2":
+        return 1.0 - distance / 2.0
+    return 1.0 - distance
+
+
+def adaptive_k(similarities: list[float], k: int, max_k: int, min_gap: float = 0.05) -> int:
+    """
+    Cuántos resultados de una query conservar, con sus similitudes en orden descendente: se corta en el mayor
+    salto entre dos resultados consecutivos (entre el primero y el max_k-ésimo) si es de al menos `min_gap`.
+    Sin un salto claro se conservan los `k` de siempre.
+    """
+    similarities = similarities[:max_k]
+    if len(similarities) <= 1:
+        return len(similarities)
+    gaps = [similarities[j - 1] - similarities[j] for j in range(1, len(similarities))]
+    best = max(range(len(gaps)), key=gaps.__getitem__)
+    if gaps[best] < min_gap:
+        return min(k, len(similarities))
+    return best + 1
+
+
+def triage_by_similarity(docs: list[Document], reject_below: float, accept_from: float):
+    """
+    Reparte los chunks según su similitud con las queries: (aceptados, dudosos, descartados).
+    Los que no tienen similitud (p.ej. recuperados de otra forma) van a dudosos.
+    """
+    accepted, ambiguous, rejected = [], [], []
+    for doc in docs:
+        similarity = doc.metadata.get("similarity")
+        if similarity is None:
+            ambiguous.append(doc)
+        elif similarity >= accept_from:
+            accepted.append(doc)
+        elif similarity < reject_below:
+            rejected.append(doc)
+        else:
+            ambiguous.append(doc)
+    return accepted, ambiguous, rejected
+
+
+def calibrate_thresholds(samples, reject_below: float, accept_from: float, precision: float = 0.95,
+                         min_support: int = 20, min_band: float = 0.1) -> tuple[float, float]:
+    """
+    Ajusta los umbrales con los veredictos del LLM sobre la franja dudosa, `samples` = [(similitud, relevante)]:
+    - accept_from baja hasta la menor similitud por encima de la cual al menos `precision` de los chunks fueron relevantes.
+    - reject_below sube hasta la mayor similitud por debajo de la cual al menos `precision` fueron irrelevantes.
+    Solo hay veredictos dentro de la franja, así que los umbrales solo se acercan entre sí, con
+    al menos `min_support` veredictos detrás y dejando siempre una franja de `min_band` para seguir midiendo.
+    """
+    samples = sorted((s, r) for s, r in samples if reject_below <= s < accept_from)
+    if len(samples) < 2 * min_support:
+        return reject_below, accept_from
+    new_accept = accept_from
+    relevant = 0
+    for n, (similarity, is_relevant) in enumerate(reversed(samples), start=1):
+        relevant += is_relevant
+        if n >= min_support and relevant / n >= precision:
+            new_accept = similarity
+        elif n >= min_support:
+            break
+    new_reject = reject_below
+    irrelevant = 0
+    for n, (similarity, is_relevant) in enumerate(samples, start=1):
+        irrelevant += not is_relevant
+        if n >= min_support and irrelevant / n >= precision:
+            new_reject = similarity
+        elif n >= min_support:
+            break
+    if new_accept - new_reject < min_band:
+        middle = (new_accept + new_reject) / 2
+        new_reject = max(reject_below, middle - min_band / 2)
+        new_accept = min(accept_from, middle + min_band / 2)
+    return new_reject, new_accept
+
+
+def rrf_fuse(rankings: list[list[str]], k: int = 60) -> dict[str, float]:
+    """Reciprocal rank fusion: cada lista aporta 1 / (k + posición) a los ids que contiene."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def mmr_select(query_vectors: np.ndarray, candidate_vectors: np.ndarray, top_n: int, lambda_mult: float = 0.5) -> list[int]:
+    """
+    Maximal marginal relevance sobre los candidatos de varias queries.
+    Relevancia de un candidato = su mayor similitud coseno con alguna de las queries.
+    En cada paso se elige el que maximiza lambda * relevancia - (1 - lambda) * (similitud máxima con los ya elegidos).
+    """
+    def _unit(m):
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        return m / np.where(norms == 0, 1, norms)
+
+    candidates = _unit(np.asarray(candidate_vectors, dtype=np.float32))
+    relevance = (candidates @ _unit(np.asarray(query_vectors, dtype=np.float32)).T).max(axis=1)
+    similarity = candidates @ candidates.T
+    n = len(candidates)
+    selected: list[int] = []
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(top_n, n)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        # La redundancia de cada candidato es su similitud máxima con lo ya elegido
+        redundancy = similarity[best] if len(selected) == 1 else np.maximum(redundancy, similarity[best])
+    return selected
+
+
+def _to_documents(result: dict, n_queries: int, space: str = "l2") -> list[list[Document]]:
+    # La distancia y la similitud coseno se guardan en los metadatos para ordenar y filtrar los chunks más adelante
+    docs = []
+    for i in range(n_queries):
+        docs.append([
+            Document(page_content=text, metadata={
+                **(metadata or {}), "chunk_id": (metadata or {}).get("chunk_id", chunk_id),
+                "distance": distance, "similarity": distance_to_similarity(distance, space),
+            })
+            for chunk_id, text, metadata, distance in zip(result["ids"][i], result["documents"][i], result["metadatas"][i], result["distances"][i])
+        ])
+    return docs
+
+
+async def batched_search(vectorstore, queries: list[str], k: int = 3, writer=None,
+                         mode: str = "similarity", fetch_k: int | None = None, lambda_mult: float = 0.5,
+                         lexical_index=None, max_k: int | None = None) -> list[Document]:
+    """
+    Recuperación por lotes para las queries expandidas:
+    1. Un único embedding de todas las queries.
+    2. Se descartan las queries duplicadas o casi duplicadas.
+    3. Se agrupan por filtro (años y ficheros que menciona la query) y se lanza una consulta multi-embedding por grupo.
+    4. Un chunk que devuelven varias queries se queda una sola vez (su aparición más relevante).
+    mode="similarity": los `k` más cercanos de cada query, en el orden de las queries.
+    mode="mmr": se piden `fetch_k` candidatos por query y se eligen k * nº de queries con MMR sobre sus embeddings.
+    Con `lexical_index` (BM25) la búsqueda es híbrida: para cada query se fusionan la lista vectorial y la léxica
+    con reciprocal rank fusion, y los chunks que solo aparecen en la léxica se leen de la colección en una llamada.
+    Con `max_k` (modo similarity) el número de chunks por query es adaptativo: se piden `max_k` y se conservan
+    los que quedan por encima del mayor salto de similitud (adaptive_k), en el orden del ranking.
+    Cada chunk lleva en metadata["similarity"] su mayor similitud coseno con las queries.
+    """
+    if not queries:
+        return []
+    vectors = await vectorstore.embeddings.aembed_documents(queries)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    keep = dedupe_queries(queries, vectors)
+    if writer and len(keep) < len(queries):
+        writer({"custom_key": f"Descartadas {len(queries) - len(keep)} queries duplicadas."})
+
+    # Las queries con los mismos filtros (años y ficheros mencionados) comparten consulta
+    sources = lexical_index.sources() if lexical_index is not None else ()
+    filters = {i: (query_years(queries[i]), source_hints(queries[i], sources)) for i in keep}
+    groups: dict[tuple, list[int]] = {}
+    for i in keep:
+        groups.setdefault(filters[i], []).append(i)
+
+    mmr = mode == "mmr"
+    adaptive = bool(max_k) and not mmr
+    n_results = (fetch_k or 3 * k) if mmr else max(k, max_k) if adaptive else k
+    include = ["documents", "metadatas", "distances"] + (["embeddings"] if mmr else [])
+    space = collection_space(vectorstore._collection)
+
+    async def _query_group(query_filter, indices):
+        years, hinted = query_filter
+        if writer and (years or hinted):
+            writer({"custom_key": f"Aplicando filtro years={list(years)} sources={list(hinted)} para {len(indices)} queries."})
+        result = await asyncio.to_thread(
+            vectorstore._collection.query,
+            query_embeddings=vectors[indices].tolist(),
+            n_results=n_results,
+            where=build_where(years, hinted),
+            include=include,
+        )
+        docs = _to_documents(result, len(indices), space)
+        embeddings = result["embeddings"] if mmr else [[None] * len(d) for d in docs]
+        return {i: list(zip(docs[j], embeddings[j])) for j, i in enumerate(indices)}
+
+    per_query: dict[int, list[tuple[Document, object]]] = {}
+    for partial in await asyncio.gather(*(_query_group(f, idx) for f, idx in groups.items())):
+        per_query.update(partial)
+
+    if lexical_index is not None and len(lexical_index):
+        per_query = await _fuse_lexical(vectorstore, lexical_index, queries, keep, filters, per_query, n_results, mmr, writer, vectors)
+
+    # Top-k adaptativo: el corte sale de la curva de similitudes (descendente) de los candidatos finales de cada
+    # query, ya fusionados con BM25 si lo hay. Tras la fusión el ranking es el de RRF, que no sigue la similitud:
+    # el corte se convierte en un umbral (la similitud del último que queda antes del salto) y se conservan,
+    # en orden RRF, los chunks que lo alcanzan
+    if adaptive:
+        cuts = {}
+        for i in keep:
+            curve = sorted((doc.metadata["similarity"] for doc, _ in per_query[i]), reverse=True)
+            cut = adaptive_k(curve, k, max_k)
+            if cut:
+                threshold = curve[cut - 1]
+                per_query[i] = [(doc, e) for doc, e in per_query[i] if doc.metadata["similarity"] >= threshold][:cut]
+            cuts[i] = len(per_query[i])
+        if writer:
+            writer({"custom_key": f"Top-k adaptativo: {[cuts[i] for i in keep]} chunks por query."})
+
+    # Un mismo chunk devuelto por varias queries: se conserva la aparición más relevante y su mayor similitud
+    unique: dict[str, tuple[Document, object]] = {}
+    similarity: dict[str, float] = {}
+    for i in keep:
+        for doc, embedding in per_query[i]:
+            key = chunk_key(doc)
+            if key not in unique or relevance_key(doc) < relevance_key(unique[key][0]):
+                unique[key] = (doc, embedding)
+            if doc.metadata.get("similarity") is not None:
+                similarity[key] = max(similarity.get(key, -1.0), doc.metadata["similarity"])
+    for key, (doc, _) in unique.items():
+        if key in similarity:
+            doc.metadata["similarity"] = similarity[key]
+    total = sum(len(per_query[i]) for i in keep)
+    if writer and len(unique) < total:
+        writer({"custom_key": f"Descartados {total - len(unique)} chunks repetidos entre queries."})
+
+    candidates = list(unique.values())
+    if not mmr or not candidates:
+        return [doc for doc, _ in candidates]
+    selected = mmr_select(vectors[keep], np.asarray([e for _, e in candidates]), k * len(keep), lambda_mult)
+    return [candidates[i][0] for i in selected]
+
+
+async def _fuse_lexical(vectorstore, lexical_index, queries, keep, filters, per_query, n_results, mmr, writer, vectors):
+    """
+    Fusiona con RRF los resultados vectoriales de cada query con los de BM25 y se queda con los `n_results` primeros.
+    La similitud de los chunks que solo ha encontrado BM25 se calcula con su embedding.
+    """
+    lexical = {i: [chunk_id for chunk_id, _ in lexical_index.search(queries[i], n_results, *filters[i])] for i in keep}
+    known = {doc.metadata["chunk_id"]: (doc, embedding) for i in keep for doc, embedding in per_query[i]}
+    missing = list({chunk_id for ids in lexical.values() for chunk_id in ids if chunk_id not in known})
+    if missing:
+        result = await asyncio.to_thread(
+            vectorstore._collection.get,
+            ids=missing,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        query_vectors = vectors[keep]
+        query_vectors = query_vectors / np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+        for j, chunk_id in enumerate(result["ids"]):
+            embedding = np.asarray(result["embeddings"][j], dtype=np.float32)
+            similarity = float((query_vectors @ (embedding / max(float(np.linalg.norm(embedding)), 1e-12))).max())
+            metadata = {**(result["metadatas"][j] or {}), "chunk_id": chunk_id, "similarity": similarity}
+            embedding = embedding if mmr else None
+            known[chunk_id] = (Document(page_content=result["documents"][j], metadata=metadata), embedding)
+        if writer:
+            writer({"custom_key": f"Búsqueda léxica: {len(missing)} chunks que no había encontrado la búsqueda vectorial."})
+
+    fused = {}
+    for i in keep:
+        scores = rrf_fuse([[doc.metadata["chunk_id"] for doc, _ in per_query[i]], lexical[i]])
+        ranked = sorted((chunk_id for chunk_id in scores if chunk_id in known), key=lambda c: -scores[c])[:n_results]
+        fused[i] = []
+        for chunk_id in ranked:
+            doc, embedding = known[chunk_id]
+            # Cada query tiene su propia puntuación: se copia el documento para no pisar la de otra query
+            fused[i].append((Document(page_content=doc.page_content, metadata={**doc.metadata, "score": scores[chunk_id]}), embedding))
+    return fused
@@ -0,0 +1,191 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+SEARCH_CACHE_PATH = "./services/agents/search_cache.json"
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query.strip().lower())
+
+
+class SearchCache:
+    """
+    Cache de resultados de búsqueda web compartida entre peticiones.
+    - Clave: query normalizada + parámetros de la búsqueda.
+    - TTL: dentro de `ttl` segundos el resultado se sirve directamente.
+    - Stale-while-revalidate: hasta `ttl + stale_ttl` se sirve el resultado viejo y se refresca en segundo plano.
+    - Expulsión LRU a partir de `max_entries`.
+    - Persistencia opcional en un JSON: se guarda como mucho cada `save_interval` segundos (lo que llega
+      antes queda programado para el final del intervalo) y una última vez al cerrar el proceso.
+    """
+
+    def __init__(self, ttl: float = 6 * 3600, stale_ttl: float = 24 * 3600, max_entries: int = 2000,
+                 persist_path: str | None = None, save_interval: float = 30):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.save_interval = save_interval
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._refreshing: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._last_save = 0.0
+        self._dirty = False
+        self._saving = False
+        self._pending_save: asyncio.TimerHandle | None = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._load()
+        if persist_path:
+            atexit.register(self.save)
+
+    @staticmethod
+    def key(query: str, **params) -> str:
+        raw = json.dumps({"q": normalize_query(query), **params}, sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def get_or_fetch(self, query: str, fetch, **params):
+        """Devuelve el resultado cacheado para (query, params) o llama a `fetch()` y lo guarda."""
+        key = self.key(query, **params)
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = now - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    task = asyncio.create_task(self._refresh(key, fetch))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                return entry[1]
+
+        # Si otra petición ya está buscando lo mismo, se espera a su resultado
+        task = self._inflight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # La búsqueda no pertenece a ninguna petición: si la que la lanzó se cancela (cliente desconectado)
+            # las demás que la esperan siguen recibiendo el resultado, y este queda en la cache
+            task = self._inflight[key] = asyncio.create_task(self._fetch(key, fetch))
+            # Si nadie la espera ya, su error no debe acabar como "Task exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, fetch):
+        try:
+            result = await fetch()
+            self._store(key, result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    async def _refresh(self, key: str, fetch) -> None:
+        try:
+            self._store(key, await fetch())
+        except Exception as e:
+            print(f"[search_cache] refresh failed: {e}")
+        finally:
+            self._refreshing.discard(key)
+
+    def _store(self, key: str, result) -> None:
+        self._entries[key] = (time.time(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+        if self.persist_path:
+            self._schedule_save()
+
+    def _schedule_save(self) -> None:
+        # Ya hay una escritura en curso o programada: al terminar recoge también estos cambios
+        if self._saving or self._pending_save is not None:
+            return
+        elapsed = time.time() - self._last_save
+        if elapsed >= self.save_interval:
+            self._start_save()
+        else:
+            self._pending_save = asyncio.get_running_loop().call_later(self.save_interval - elapsed, self._start_save)
+
+    def _start_save(self) -> None:
+        self._pending_save = None
+        if self._saving or not self._dirty:
+            return
+        # El JSON puede ser grande: se escribe en un hilo para no bloquear el event loop
+        self._saving = True
+        task = asyncio.create_task(self._save_in_thread())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _save_in_thread(self) -> None:
+        # La copia y el estado se toman en el event loop; el hilo solo serializa y escribe la copia
+        entries = dict(self._entries)
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, entries)
+            self._last_save = time.time()
+        except OSError as e:
+            self._dirty = True
+            print(f"[search_cache] could not save {self.persist_path}: {e}")
+        finally:
+            self._saving = False
+        # Lo guardado mientras se escribía (o tras un error) espera al siguiente intervalo
+        if self._dirty:
+            self._schedule_save()
+
+    def _load(self) -> None:
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[search_cache] could not load {self.persist_path}: {e}")
+            return
+        now = time.time()
+        for key, (ts, result) in data.items():
+            if now - ts < self.ttl + self.stale_ttl:
+                self._entries[key] = (ts, result)
+
+    def save(self) -> None:
+        """Escritura síncrona de lo pendiente; se registra con atexit para no perder lo último cacheado."""
+        if not self.persist_path or not self._dirty:
+            return
+        entries = dict(self._entries)
+        self._dirty = False
+        try:
+            self._write(entries)
+            self._last_save = time.time()
+        except OSError as e:
+            self._dirty = True
+            print(f"[search_cache] could not save {self.persist_path}: {e}")
+
+    def _write(self, entries: dict) -> None:
+        tmp = self.persist_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp, self.persist_path)
+
+    def stats(self) -> dict:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / total, 3) if total else 0.0,
+        }
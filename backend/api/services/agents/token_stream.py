@@ -0,0 +1,47 @@
+import itertools
+
+from langchain_core.messages import BaseMessageChunk
+
+# Evento con un trozo de texto de un informe según lo escribe el modelo:
+# {"token_key": {"agent": ..., "attempt": ..., "text": ...}}
+# Cada generación empieza con {"token_key": {"agent": ..., "attempt": ..., "start": True, "text": ""}}: un agente
+# puede generar su informe más de una vez (segunda iteración del RAG, bucle de reflexión del web) y el borrador
+# anterior de ese agente deja de valer.
+TOKEN_KEY = "token_key"
+
+_attempts = itertools.count(1)
+
+
+def chunk_text(chunk: BaseMessageChunk) -> str:
+    """Texto de un chunk del stream (con la Responses API el contenido llega como lista de bloques)."""
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def token_event(agent: str, text: str, attempt: int) -> dict:
+    return {TOKEN_KEY: {"agent": agent, "attempt": attempt, "text": text}}
+
+
+def token_start(agent: str) -> tuple[int, dict]:
+    """Id de una nueva generación de `agent` y el evento que la anuncia."""
+    attempt = next(_attempts)
+    return attempt, {TOKEN_KEY: {"agent": agent, "attempt": attempt, "start": True, "text": ""}}
+
+
+async def astream_text(model, prompt, writer, agent: str) -> str:
+    """
+    Llama al modelo en streaming: emite el inicio de la generación (token_start) y cada trozo de texto con
+    `writer` como token_event(agent, trozo, attempt) según llega. Devuelve la respuesta completa, igual que
+    `(await model.ainvoke(prompt)).content`.
+    """
+    attempt, start = token_start(agent)
+    writer(start)
+    parts = []
+    async for chunk in model.astream(prompt):
+        text = chunk_text(chunk)
+        if text:
+            parts.append(text)
+            writer(token_event(agent, text, attempt))
+    return "".join(parts)
@@ -123,6 +123,29 @@ Here is all the research data:
 Return a markdown text (including markdown features) with the completed text and the extracted information with as much detail as possible.
 """
 
+# Prompt for the fast mode: takes notes and completes the schema in a single call over the raw search results. @param: schema, company name, pending sections, user instructions, search results
+FAST_COMPILER_PROMPT = """
+You are a company analysis writer, expert in extracting and organizing relevant data about a company.
+Your task is to read the raw content found by a web search about the company {company} and apply the relevant facts to the schema in a single pass.
+The schema may be incomplete, so you should complete it with the information found in the search results.
+Replace or add information.
+
+Stick to changing the following pending sections: {pending_sections}
+Additional instructions: {user_notes}
+<schema_to_complete> {schema} </schema_to_complete>
+
+Here are the search results, grouped by the query that found them:
+
+<search_results>
+{content}
+</search_results>
+
+1. Use only information supported by the search results, ignoring content that is not about the company.
+2. Include specific facts, dates, and figures when available.
+3. Indicate when important information seems to be missing or unclear with "unknown".
+Return a markdown text (including markdown features) with the completed text and the extracted information with as much detail as possible.
+"""
+
 # Prompt to analyze the extracted information about the company, deciding if it is sufficient or incomplete. @param: schema, company name, extracted content
 REFLECTION_PROMPT = """You are a research analyst tasked with reviewing the quality and completeness of the extracted information about a company.
 
@@ -219,6 +242,23 @@ Here is all the research data:
 Return a markdown text (including markdown features) with the completed report and the extracted information with as much detail as possible.
 """
 
+fast_compilador_prompt_Nsch="""
+You are a company analysis writer, expert in extracting and organizing relevant data about a company.
+Your task is to read the raw content found by a web search about the company {company} and use it to write the report in a single pass.
+
+These are the instructions to follow:
+<instruction> {instructions} </instruction>
+
+Here are the search results, grouped by the query that found them:
+
+<search_results>
+{content}
+</search_results>
+
+Use only information supported by the search results, including specific facts, dates, and figures when available, and indicate missing or unclear information with "unknown".
+Return a markdown text (including markdown features) with the report and the extracted information with as much detail as possible.
+"""
+
 reflection_prompt_Nsch="""
 You are a research analyst tasked with reviewing the quality and completeness of the extracted information about a user query.
 
@@ -1,10 +1,13 @@
 from .agents.web_search_agent_utils import extract_clean_text
 from .agents.global_agents     import GlobalAgent
+from .agents.llm_cache         import BoundedLLMCache
+from .checkpointer             import BoundedCheckpointer, CHECKPOINT_DB_PATH
+from .openai_limiter           import limited_http_client, limited_async_http_client
 
 from langchain_openai import ChatOpenAI
 import os
-import asyncio
 from langchain.schema import HumanMessage, AIMessage
+from .event_loop import run_sync, iterate_sync
 
 class ChatService:
     def __init__(self):
@@ -20,6 +23,9 @@ class ChatService:
             api_key=openai_key,
             temperature=0.1,
             max_tokens=5000,
+            # Todas las llamadas a OpenAI del proceso pasan por el mismo limitador de RPM/TPM
+            http_client=limited_http_client(),
+            http_async_client=limited_async_http_client(),
         )
         self.llm_reasoning = ChatOpenAI(
             model_name="o4-mini-2025-04-16",
@@ -27,9 +33,15 @@ class ChatService:
             model_kwargs={"reasoning": reasoning},
             api_key=openai_key,
             max_tokens=25000,
+            http_client=limited_http_client(),
+            http_async_client=limited_async_http_client(),
         )
+        # Cache de respuestas para los nodos deterministas (planificador, expansión de queries, reflexiones)
+        self.llm_cache = BoundedLLMCache(max_entries=1000)
+        # Memoria de las conversaciones: acotada en RAM y persistida en SQLite en segundo plano
+        self.checkpointer = BoundedCheckpointer(db_path=CHECKPOINT_DB_PATH)
         # 2) Instanciamos nuestro agente global
-        self.global_agent = GlobalAgent(model=self.llm, reasoning_model=self.llm_reasoning)
+        self.global_agent = GlobalAgent(model=self.llm, reasoning_model=self.llm_reasoning, llm_cache=self.llm_cache, checkpointer=self.checkpointer)
 
 
     def process_query(self, message):
@@ -44,7 +56,7 @@ class ChatService:
             "response": f"Received: {message} with schema: {schema}"
         }
     
-    def process_query_global_agent(self, message, conversation_id, schema=None, rag_only=False, web_only=False):
+    def process_query_global_agent(self, message, conversation_id, schema=None, rag_only=False, web_only=False, web_mode="thorough"):
         # 3) Preparamos el estado inicial y la config del grafo
         state = {
             "messages": [ HumanMessage(content=message) ],
@@ -81,15 +93,33 @@ class ChatService:
             last_resp = "Lo siento, no obtuve respuesta."
             # 4) Iteramos por todos los chunks del stream
            
-            last_resp = await self.global_agent.run(message, config, schema, rag_only, web_only) 
+            last_resp = await self.global_agent.run(message, config, schema, rag_only, web_only, web_mode=web_mode)
             #if last_resp.startswith("```") or "<schema_to_complete>" in last_resp:
             #            last_resp = extract_clean_text(last_resp)    
             return last_resp
-        # 5) Ejecutamos el coroutine y devolvemos el resultado
-        respuesta = asyncio.run(_run_2(rag_only, web_only))
+        # 5) Ejecutamos el coroutine en el event loop compartido y devolvemos el resultado
+        respuesta = run_sync(_run_2(rag_only, web_only))
         print("🔍 RESPUESTA ENVIADA:", respuesta)
         return {
             "status": "success",
             "response": respuesta
         }
-    
+
+    def stream_query_global_agent(self, message, conversation_id, schema=None, rag_only=False, web_only=False, web_mode="thorough"):
+        """
+        Versión en streaming de process_query_global_agent: devuelve un generador (síncrono, para Flask)
+        con los eventos del grafo según se producen. El último evento contiene "final_key".
+        """
+        config = {
+            "configurable": {
+                "thread_id": conversation_id
+            }
+        }
+        try:
+            for event in iterate_sync(self.global_agent.run_stream(message, config, schema, rag_only, web_only, web_mode=web_mode)):
+                yield event
+        except TimeoutError as e:
+            # Mismo mensaje que el 504 de las rutas sin streaming
+            yield {"error_key": str(e), "status": 504}
+        except Exception as e:
+            yield {"error_key": str(e)}
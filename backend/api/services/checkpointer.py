@@ -0,0 +1,326 @@
+import asyncio
+import atexit
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+CHECKPOINT_DB_PATH = "./services/agents/checkpoints.sqlite3"
+
+
+class CompressedSerializer:
+    """Comprime con zlib lo que serializa `serde` cuando pasa de `min_size` bytes."""
+
+    def __init__(self, serde=None, min_size: int = 512, level: int = 1):
+        self.serde = serde or JsonPlusSerializer()
+        self.min_size = min_size
+        self.level = level
+
+    def dumps_typed(self, obj):
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) >= self.min_size:
+            return f"z:{type_}", zlib.compress(data, self.level)
+        return type_, data
+
+    def loads_typed(self, data):
+        type_, payload = data
+        if type_.startswith("z:"):
+            return self.serde.loads_typed((type_[2:], zlib.decompress(payload)))
+        return self.serde.loads_typed(data)
+
+
+class BoundedCheckpointer(InMemorySaver):
+    """
+    Checkpointer de LangGraph acotado:
+    - Checkpoints, escrituras y valores de los canales se guardan comprimidos (CompressedSerializer).
+    - Por conversación solo se conservan los últimos `max_checkpoints` checkpoints de cada namespace.
+    - En memoria hay como mucho `max_threads` conversaciones (LRU) y se expulsan las inactivas más de `ttl` segundos.
+    - Con `db_path`, cada conversación se guarda en SQLite desde un hilo aparte (las escrituras se agrupan
+      cada `flush_interval` segundos, fuera del camino de la petición). Al pedir una conversación que no está
+      en memoria (expulsada, reinicio u otro worker) se carga de SQLite; las filas más viejas que `db_ttl` se borran.
+      Desde el event loop (aget_tuple, alist) esa carga se hace en un hilo para no bloquear a las demás peticiones.
+    """
+
+    def __init__(self, max_threads: int = 500, ttl: float = 6 * 3600, max_checkpoints: int = 5,
+                 db_path: str | None = None, db_ttl: float = 30 * 24 * 3600, flush_interval: float = 1.0):
+        super().__init__(serde=CompressedSerializer())
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.max_checkpoints = max_checkpoints
+        self.db_path = db_path
+        self.db_ttl = db_ttl
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        # La conexión de las lecturas se comparte entre hilos (cargas desde asyncio.to_thread)
+        self._db_lock = threading.Lock()
+        # thread_id -> último uso; el orden es el de uso (LRU)
+        self._threads: OrderedDict[str, float] = OrderedDict()
+        # thread_id -> momento de la última escritura local (para detectar versiones más nuevas de otro worker)
+        self._written: dict[str, float] = {}
+        # (thread_id, checkpoint_ns, checkpoint_id) -> versiones de los canales que referencia el checkpoint
+        self._versions: dict[tuple[str, str, str], dict] = {}
+        self._dirty: set[str] = set()
+        # Conversaciones expulsadas de memoria con cambios aún sin escribir: thread_id -> (updated_at, datos)
+        self._evicted: dict[str, tuple[float, dict]] = {}
+        self._wake = threading.Event()
+        self._closed = False
+        self.evicted = 0
+        self.loaded = 0
+        self.flushed = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, updated_at REAL, data BLOB)")
+            self._db.execute("DELETE FROM threads WHERE updated_at < ?", (time.time() - db_ttl,))
+            self._db.commit()
+            self._writer = threading.Thread(target=self._write_loop, name="checkpoint-writer", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    # ---- memoria ----
+    def _touch(self, thread_id: str) -> None:
+        now = time.time()
+        self._threads[thread_id] = now
+        self._threads.move_to_end(thread_id)
+        while len(self._threads) > self.max_threads:
+            self._evict(next(iter(self._threads)))
+        while self._threads:
+            oldest, last_used = next(iter(self._threads.items()))
+            if now - last_used <= self.ttl:
+                break
+            self._evict(oldest)
+
+    def _evict(self, thread_id: str) -> None:
+        # Lo pendiente de escribir pasa al hilo escritor (se copia, no se escribe aquí)
+        if thread_id in self._dirty:
+            self._dirty.discard(thread_id)
+            self._evicted[thread_id] = (self._written.get(thread_id, time.time()), self._snapshot(thread_id))
+            self._wake.set()
+        self._threads.pop(thread_id, None)
+        self._written.pop(thread_id, None)
+        self._drop(thread_id)
+        self.evicted += 1
+
+    def _drop(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        for key in [k for k in self._versions if k[0] == thread_id]:
+            del self._versions[key]
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        """
+        Quita los checkpoints antiguos del namespace y los valores de canal que ya nadie referencia.
+        Los subgrafos de cada turno (namespaces "chat:<id>") dejan de hacer falta cuando el turno termina:
+        se borran enteros cuando su último checkpoint es anterior a todos los que se conservan del grafo principal.
+        """
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.max_checkpoints:
+            return
+        for checkpoint_id in sorted(checkpoints)[:-self.max_checkpoints]:
+            self._remove_checkpoint(thread_id, checkpoint_ns, checkpoint_id)
+        namespaces = [checkpoint_ns]
+        if checkpoint_ns == "":
+            oldest_kept = min(checkpoints)
+            for ns, ns_checkpoints in list(self.storage[thread_id].items()):
+                if ns and (not ns_checkpoints or max(ns_checkpoints) < oldest_kept):
+                    for checkpoint_id in list(ns_checkpoints):
+                        self._remove_checkpoint(thread_id, ns, checkpoint_id)
+                    del self.storage[thread_id][ns]
+                    namespaces.append(ns)
+        for ns in namespaces:
+            referenced = {
+                (channel, version)
+                for (t, n, _), versions in self._versions.items() if t == thread_id and n == ns
+                for channel, version in versions.items()
+            }
+            for key in [k for k in self.blobs if k[0] == thread_id and k[1] == ns and (k[2], k[3]) not in referenced]:
+                del self.blobs[key]
+
+    def _remove_checkpoint(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> None:
+        del self.storage[thread_id][checkpoint_ns][checkpoint_id]
+        self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        self._versions.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+    # ---- SQLite ----
+    def _snapshot(self, thread_id: str) -> dict:
+        """
+        Copia de las estructuras de la conversación (con el lock). Los valores son tuplas de bytes que no
+        se modifican, así que la copia puede serializarse después sin el lock.
+        """
+        return {
+            "storage": {ns: dict(checkpoints) for ns, checkpoints in self.storage.get(thread_id, {}).items()},
+            "writes": {k: dict(v) for k, v in self.writes.items() if k[0] == thread_id},
+            "blobs": {k: v for k, v in self.blobs.items() if k[0] == thread_id},
+            "versions": {k: dict(v) for k, v in self._versions.items() if k[0] == thread_id},
+        }
+
+    def _restore(self, thread_id: str, data: dict, updated_at: float) -> None:
+        self._drop(thread_id)
+        for ns, checkpoints in data["storage"].items():
+            self.storage[thread_id][ns].update(checkpoints)
+        for key, writes in data["writes"].items():
+            self.writes[key] = writes
+        self.blobs.update(data["blobs"])
+        self._versions.update(data["versions"])
+        self._written[thread_id] = updated_at
+        self.loaded += 1
+
+    def _ensure_loaded(self, thread_id: str) -> None:
+        """
+        Trae la conversación de SQLite si no está en memoria o si otro worker ha guardado una versión más nueva.
+        La consulta y el unpickle se hacen sin el lock: solo se toma para decidir y para restaurar.
+        """
+        if not self.db_path:
+            return
+        with self._lock:
+            if thread_id in self._dirty:
+                return
+            if thread_id in self._evicted:
+                # Expulsada antes de que el escritor la guardara: se recupera de lo pendiente, que es lo más nuevo
+                updated_at, data = self._evicted.pop(thread_id)
+                self._restore(thread_id, data, updated_at)
+                self._dirty.add(thread_id)
+                return
+            known = self._written.get(thread_id, 0.0)
+        with self._db_lock:
+            row = self._db.execute("SELECT updated_at FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+            if row is None or row[0] <= known:
+                return
+            row = self._db.execute("SELECT updated_at, data FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        data = pickle.loads(row[1])
+        with self._lock:
+            # Mientras se leía puede haber llegado un checkpoint local o una carga más nueva
+            if thread_id in self._dirty or thread_id in self._evicted or self._written.get(thread_id, 0.0) >= row[0]:
+                return
+            self._restore(thread_id, data, row[0])
+
+    def _flush(self, db: sqlite3.Connection) -> None:
+        """
+        Escribe lo pendiente en `db`. Con el lock solo se copian las conversaciones modificadas;
+        la serialización y la escritura en SQLite se hacen sin él, sin bloquear a put/get_tuple.
+        """
+        with self._lock:
+            batch = dict(self._evicted)
+            for thread_id in self._dirty:
+                batch[thread_id] = (self._written.get(thread_id, time.time()), self._snapshot(thread_id))
+            self._dirty.clear()
+        if not batch:
+            return
+        try:
+            rows = [(thread_id, updated_at, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+                    for thread_id, (updated_at, data) in batch.items()]
+            db.executemany("INSERT OR REPLACE INTO threads (thread_id, updated_at, data) VALUES (?, ?, ?)", rows)
+            db.commit()
+        except Exception:
+            with self._lock:
+                # Se reintentará en la siguiente escritura
+                self._dirty.update(t for t in batch if t in self._threads and t not in self._evicted)
+            raise
+        with self._lock:
+            for thread_id, entry in batch.items():
+                if self._evicted.get(thread_id) is entry:
+                    del self._evicted[thread_id]
+            self.flushed += len(rows)
+
+    def _write_loop(self) -> None:
+        # Conexión propia: las lecturas de las peticiones usan self._db mientras este hilo escribe
+        db = sqlite3.connect(self.db_path, timeout=30)
+        while not self._closed:
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(self.flush_interval)  # agrupa los checkpoints de un mismo turno en una escritura
+            try:
+                self._flush(db)
+            except Exception as e:
+                print(f"[checkpointer] could not persist checkpoints: {e}")
+        db.close()
+
+    def close(self) -> None:
+        if not self.db_path or self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._writer.join(timeout=self.flush_interval + 30)
+        with self._db_lock:
+            self._flush(self._db)
+
+    # ---- API de BaseCheckpointSaver ----
+    def get_tuple(self, config):
+        self._ensure_loaded(config["configurable"]["thread_id"])
+        return self._get_loaded(config)
+
+    async def aget_tuple(self, config):
+        if self.db_path:
+            await asyncio.to_thread(self._ensure_loaded, config["configurable"]["thread_id"])
+        return self._get_loaded(config)
+
+    def _get_loaded(self, config):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        if config:
+            self._ensure_loaded(config["configurable"]["thread_id"])
+        yield from self._list_loaded(config, filter, before, limit)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        if config and self.db_path:
+            await asyncio.to_thread(self._ensure_loaded, config["configurable"]["thread_id"])
+        for item in self._list_loaded(config, filter, before, limit):
+            yield item
+
+    def _list_loaded(self, config, filter, before, limit):
+        with self._lock:
+            return list(super().list(config, filter=filter, before=before, limit=limit))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            self._versions[(thread_id, checkpoint_ns, checkpoint["id"])] = dict(checkpoint["channel_versions"])
+            self._prune(thread_id, checkpoint_ns)
+            self._mark(thread_id)
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            self._mark(config["configurable"]["thread_id"])
+
+    def _mark(self, thread_id: str) -> None:
+        self._written[thread_id] = time.time()
+        self._touch(thread_id)
+        if self.db_path:
+            self._dirty.add(thread_id)
+            self._wake.set()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._drop(thread_id)
+            self._threads.pop(thread_id, None)
+            self._written.pop(thread_id, None)
+            self._dirty.discard(thread_id)
+            self._evicted.pop(thread_id, None)
+            if self.db_path:
+                with self._db_lock:
+                    self._db.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+                    self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "threads_in_memory": len(self._threads),
+                "checkpoints_in_memory": len(self._versions),
+                "blob_bytes": sum(len(v[1]) for v in self.blobs.values()),
+                "pending_writes": len(self._dirty) + len(self._evicted),
+                "evicted": self.evicted,
+                "loaded": self.loaded,
+                "flushed": self.flushed,
+                "persistent": bool(self.db_path),
+            }
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_DIR = "./services/agents/embedding_cache"
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Cache persistente de embeddings direccionada por contenido.
+    - Clave: hash de (modelo, texto), así el mismo texto nunca se vuelve a embeber con el mismo modelo.
+    - Vectores: un fichero binario por modelo (float32 o float16) leído con np.memmap.
+    - Índice clave -> fila en SQLite. Las filas se asignan dentro de una transacción BEGIN IMMEDIATE,
+      que serializa las escrituras de todos los procesos (workers) que comparten el directorio.
+    Envuelve el cliente de embeddings que usan tanto la ingesta como las consultas del RagAgent.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR, dtype: str = "float32"):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in model_name)
+        self._vectors_path = os.path.join(cache_dir, f"{safe_name}.{self.dtype.name}")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, f"{safe_name}.sqlite3"), timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, row INTEGER)")
+        self._db.commit()
+        self._dim = self._read_dim()
+        # Filas que sabemos escritas en el fichero (otro proceso puede haber añadido más)
+        self._rows = self._next_row()
+        self._mm = None
+
+    def _read_dim(self) -> int | None:
+        dim = self._db.execute("SELECT v FROM meta WHERE k = 'dim'").fetchone()
+        return int(dim[0]) if dim else None
+
+    def _next_row(self) -> int:
+        return self._db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _map(self, rows: int):
+        # Se vuelve a mapear el fichero cuando ha crecido desde la última lectura (aquí o en otro proceso)
+        self._rows = max(self._rows, rows)
+        if self._dim is None:
+            self._dim = self._read_dim()
+        if self._mm is None or self._mm.shape[0] < self._rows:
+            self._mm = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self._rows, self._dim))
+        return self._mm
+
+    def _lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self._lock:
+            unique = list(set(keys))
+            rows = {}
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.update(self._db.execute(f"SELECT key, row FROM embeddings WHERE key IN ({placeholders})", batch).fetchall())
+            if rows:
+                # Una fila solo está en SQLite cuando su vector ya está escrito en el fichero
+                mm = self._map(max(rows.values()) + 1)
+                for key, row in rows.items():
+                    found[key] = mm[row].astype(np.float32).tolist()
+        return found
+
+    def _store(self, items: dict[str, list[float]]) -> None:
+        if not items:
+            return
+        with self._lock:
+            # Bloqueo de escritura de SQLite: otro proceso no puede asignar filas hasta el commit
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Otro hilo o proceso puede haber guardado las mismas claves mientras se calculaban
+                keys = list(items)
+                existing = set()
+                for i in range(0, len(keys), 500):
+                    batch = keys[i:i + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    existing.update(k for (k,) in self._db.execute(f"SELECT key FROM embeddings WHERE key IN ({placeholders})", batch))
+                items = {k: v for k, v in items.items() if k not in existing}
+                if not items:
+                    self._db.rollback()
+                    return
+                vectors = np.asarray(list(items.values()), dtype=self.dtype)
+                self._dim = self._read_dim()
+                if self._dim is None:
+                    self._dim = vectors.shape[1]
+                    self._db.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('dim', ?)", (str(self._dim),))
+                # Se escribe en la posición de la siguiente fila libre (descarta restos de escrituras interrumpidas)
+                start = self._next_row()
+                mode = "r+b" if os.path.exists(self._vectors_path) else "wb"
+                with open(self._vectors_path, mode) as f:
+                    f.seek(start * self._dim * self.dtype.itemsize)
+                    f.write(vectors.tobytes())
+                    f.truncate()
+                self._db.executemany(
+                    "INSERT INTO embeddings (key, row) VALUES (?, ?)",
+                    [(key, start + i) for i, key in enumerate(items)],
+                )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._rows = max(self._rows, start + len(items))
+
+    def _split(self, texts: list[str]):
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += sum(1 for k in keys if k in found)
+        self.misses += len(missing)
+        return keys, found, missing
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, missing = self._split(texts)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        # SQLite y el memmap son E/S bloqueante: fuera del event loop
+        keys, found, missing = await asyncio.to_thread(self._split, texts)
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            await asyncio.to_thread(self._store, computed)
+            found.update(computed)
+        return [found[k] for k in keys]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": self._rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,60 @@
+import asyncio
+import queue
+import threading
+
+# Event loop persistente compartido por todas las peticiones.
+# Los clientes async (ChatOpenAI, AsyncTavilyClient) mantienen así sus pools de conexiones
+# entre peticiones y las conversaciones concurrentes solapan su I/O en el mismo loop.
+_loop: asyncio.AbstractEventLoop | None = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Devuelve el loop compartido, arrancándolo en un hilo daemon la primera vez."""
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="agents-event-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run_sync(coro, timeout: float | None = None):
+    """Ejecuta la coroutine en el loop compartido y espera su resultado desde un hilo síncrono (Flask)."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def iterate_sync(agen):
+    """
+    Consume un generador asíncrono en el loop compartido y devuelve sus elementos como un generador síncrono.
+    Si el consumidor cierra el generador (p.ej. el cliente corta el stream), se cancela la tarea.
+    """
+    items = queue.Queue()
+    done = object()
+
+    async def _pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(_pump(), get_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,117 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from services.file_processor import UPLOAD_FOLDER
+from services.vector_db import PAGES_PER_SPLIT, PARSE_WORKERS, PROCESSED_FOLDER
+from services.vector_db_utils import process_md_dir, process_pdfs
+
+# Etapas por fichero: queued -> parsing -> parsed -> chunked -> embedded -> indexed (o failed)
+STAGES = ("queued", "parsing", "parsed", "chunked", "embedded", "indexed", "failed")
+
+
+def _md_name(file_name: str) -> str:
+    return file_name.replace(".pdf", ".md")
+
+
+class IngestionJobManager:
+    """
+    Ingesta en segundo plano:
+    - start_parsing(): se llama al subir los ficheros y lanza ya su parseo.
+    - submit(): crea un trabajo que espera al parseo y trocea, embebe e indexa; devuelve su id al momento.
+    - status(): estado del trabajo y etapa de cada fichero.
+    Un pool acotado ejecuta los parseos y otro los trabajos; la indexación se serializa
+    porque todos los trabajos escriben en la misma colección y el mismo manifiesto.
+    Los trabajos terminados se olvidan `job_ttl` segundos después de acabar.
+    """
+
+    def __init__(self, max_parse_workers: int = 2, max_job_workers: int = 2, uploaded_dir: str = UPLOAD_FOLDER,
+                 processed_dir: str = PROCESSED_FOLDER, job_ttl: float = 3600):
+        self.job_ttl = job_ttl
+        self.uploaded_dir = uploaded_dir
+        self.processed_dir = processed_dir
+        self._parse_pool = ThreadPoolExecutor(max_workers=max_parse_workers, thread_name_prefix="ingestion-parse")
+        self._job_pool = ThreadPoolExecutor(max_workers=max_job_workers, thread_name_prefix="ingestion-job")
+        self._index_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._parsing: dict[str, Future] = {}
+        self._jobs: dict[str, dict] = {}
+
+    def _parse(self, file_name: str) -> None:
+        process_pdfs(self.uploaded_dir, self.processed_dir, [file_name], max_workers=PARSE_WORKERS, pages_per_split=PAGES_PER_SPLIT)
+
+    def start_parsing(self, file_names: list[str]) -> None:
+        """Encola el parseo de los ficheros recién subidos (si se vuelven a subir, se vuelven a parsear)."""
+        with self._lock:
+            for name in file_names:
+                self._parsing[name] = self._parse_pool.submit(self._parse, name)
+
+    def submit(self, file_names: list[str], conversation_id: str) -> str:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "conversation_id": conversation_id,
+            "status": "queued",
+            "files": {name: "queued" for name in file_names},
+            "stats": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = job
+            for name in file_names:
+                # Si no se parseó al subirlo (o aquel parseo falló) se lanza ahora
+                previous = self._parsing.get(name)
+                if previous is None or (previous.done() and previous.exception() is not None):
+                    self._parsing[name] = self._parse_pool.submit(self._parse, name)
+        self._job_pool.submit(self._run, job)
+        return job_id
+
+    def _set_stage(self, job: dict, name: str, stage: str) -> None:
+        with self._lock:
+            job["files"][name] = stage
+
+    def _run(self, job: dict) -> None:
+        job["status"] = "running"
+        try:
+            for name in list(job["files"]):
+                self._set_stage(job, name, "parsing")
+                with self._lock:
+                    future = self._parsing[name]
+                future.result()
+                self._set_stage(job, name, "parsed")
+
+            by_md = {_md_name(name): name for name in job["files"]}
+
+            def on_stage(md_file, stage):
+                if md_file in by_md:
+                    self._set_stage(job, by_md[md_file], stage)
+
+            with self._index_lock:
+                job["stats"] = process_md_dir(self.processed_dir, on_stage=on_stage)
+            job["status"] = "done"
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                for name, stage in job["files"].items():
+                    if stage != "indexed":
+                        job["files"][name] = "failed"
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = time.time()
+
+    def _prune(self) -> None:
+        now = time.time()
+        for job_id in [j for j, job in self._jobs.items() if job["finished_at"] and now - job["finished_at"] > self.job_ttl]:
+            del self._jobs[job_id]
+
+    def status(self, job_id: str) -> dict | None:
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            return None if job is None else {**job, "files": dict(job["files"])}
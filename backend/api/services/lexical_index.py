@@ -0,0 +1,181 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from services.vectorstore_cache import VECTORSTORE_DIR
+
+LEXICAL_INDEX_FILE = "lexical_index.json"
+# Palabras, tickers y cifras con sus separadores (1.234,5 / 2,345.6 / 12.5%) como un único término
+_TOKEN = re.compile(r"\d+(?:[.,]\d+)*|[^\W\d_]+(?:\d+)?", re.UNICODE)
+_STOPWORDS = frozenset(
+    "a an and are as at be by de del el en for from has in is it la las los of on or para por que the to was were with y".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        # Las cifras también se indexan sin separadores, así "1,234" y "1.234" coinciden con "1234"
+        if token[0].isdigit() and not token.isdigit():
+            tokens.append(re.sub(r"[.,]", "", token))
+    return tokens
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 en memoria de los chunks del vectorstore (mismos ids que en Chroma).
+    Se actualiza en la ingesta junto a la colección (add/remove) y se guarda en un JSON
+    al lado de chroma.sqlite3. Por chunk solo se guardan sus frecuencias de términos, sus años y su fuente,
+    lo necesario para aplicar los mismos filtros que en Chroma.
+    """
+
+    def __init__(self, path: str | None = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._docs: dict[str, dict] = {}
+        self._postings: dict[str, dict[str, int]] = {}
+        self._total_len = 0
+        self._sources: Counter = Counter()
+        self._lock = threading.RLock()
+        self._mtime = None
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, ids: list[str], texts: list[str], metadatas: list[dict] | None = None) -> None:
+        with self._lock:
+            for i, (chunk_id, text) in enumerate(zip(ids, texts)):
+                if chunk_id in self._docs:
+                    self._remove(chunk_id)
+                metadata = metadatas[i] if metadatas else {}
+                tf = Counter(tokenize(text))
+                self._docs[chunk_id] = {
+                    "len": sum(tf.values()),
+                    "year": metadata.get("year"),
+                    "years": [y for y in (metadata.get("years") or "").split(",") if y],
+                    "source": metadata.get("source"),
+                    "tf": dict(tf),
+                }
+                self._total_len += sum(tf.values())
+                self._sources[metadata.get("source")] += 1
+                for term, count in tf.items():
+                    self._postings.setdefault(term, {})[chunk_id] = count
+
+    def remove(self, ids: list[str]) -> None:
+        with self._lock:
+            for chunk_id in ids:
+                if chunk_id in self._docs:
+                    self._remove(chunk_id)
+
+    def _remove(self, chunk_id: str) -> None:
+        doc = self._docs.pop(chunk_id)
+        self._total_len -= doc["len"]
+        self._sources[doc["source"]] -= 1
+        if not self._sources[doc["source"]]:
+            del self._sources[doc["source"]]
+        for term in doc["tf"]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._sources.clear()
+            self._total_len = 0
+
+    def sources(self) -> set[str]:
+        """Ficheros con algún chunk indexado."""
+        with self._lock:
+            return {source for source in self._sources if source}
+
+    @staticmethod
+    def _matches(doc: dict, years, sources) -> bool:
+        # Mismo criterio que rag_retrieval.build_where
+        if sources and doc["source"] not in sources:
+            return False
+        return not years or doc["year"] in years or any(y in years for y in doc.get("years", ()))
+
+    def search(self, query: str, k: int = 3, years=None, sources=None) -> list[tuple[str, float]]:
+        """
+        Los `k` chunks con mayor puntuación BM25 para la query, como (chunk_id, score).
+        Con `years`/`sources` solo se consideran los chunks de esos años (del fichero o del contenido) y ficheros.
+        """
+        with self._lock:
+            n = len(self._docs)
+            if not n:
+                return []
+            avg_len = self._total_len / n
+            scores: dict[str, float] = {}
+            for term in set(tokenize(query)):
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, tf in posting.items():
+                    doc = self._docs[chunk_id]
+                    if (years or sources) and not self._matches(doc, years, sources):
+                        continue
+                    norm = tf + self.k1 * (1 - self.b + self.b * doc["len"] / avg_len)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def load(self) -> None:
+        with self._lock:
+            self.clear()
+            if not self.path or not os.path.exists(self.path):
+                self._mtime = None
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                docs = json.load(f)
+            self._mtime = os.path.getmtime(self.path)
+            for chunk_id, doc in docs.items():
+                self._docs[chunk_id] = doc
+                self._total_len += doc["len"]
+                self._sources[doc.get("source")] += 1
+                for term, count in doc["tf"].items():
+                    self._postings.setdefault(term, {})[chunk_id] = count
+
+    def save(self) -> None:
+        with self._lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._docs, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    def reload_if_changed(self) -> None:
+        """Vuelve a leer el fichero si otro proceso lo ha reescrito desde la última carga."""
+        if not self.path:
+            return
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime != self._mtime:
+            self.load()
+
+
+_indexes: dict[str, BM25Index] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(persist_dir: str = VECTORSTORE_DIR) -> BM25Index:
+    """Índice léxico del vectorstore de `persist_dir`, compartido por la ingesta y las consultas."""
+    with _indexes_lock:
+        index = _indexes.get(persist_dir)
+        if index is None:
+            os.makedirs(persist_dir, exist_ok=True)
+            index = _indexes[persist_dir] = BM25Index(os.path.join(persist_dir, LEXICAL_INDEX_FILE))
+    index.reload_if_changed()
+    return index
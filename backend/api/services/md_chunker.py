@@ -0,0 +1,167 @@
+"""
+Troceado de markdown en streaming.
+Produce exactamente los mismos chunks que split_chunks(split_sections(texto)) de vector_db_utils,
+pero en una sola pasada sobre las líneas: sin cargar el fichero entero, sin copias intermedias
+(lista de líneas, secciones, bloques) y sin concatenar cadenas en cada bloque.
+"""
+import re
+from typing import Iterable, Iterator, NamedTuple
+
+HEADING = re.compile(r'#{1,6}\s')
+
+
+class Chunk(NamedTuple):
+    text: str
+    section: str  # línea de encabezado de la sección ("" antes del primer encabezado)
+    start: int  # posición del primer carácter en el texto
+    end: int  # posición siguiente al último carácter
+
+
+# Caracteres en los que corta str.splitlines()
+_LINE_BREAKS = frozenset("\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029")
+
+
+def _pieces(stream, block_size: int) -> Iterator[str]:
+    if hasattr(stream, "read"):
+        while piece := stream.read(block_size):
+            yield piece
+    else:
+        yield from stream
+
+
+def _lines(stream, block_size: int = 1 << 20) -> Iterator[tuple[str, int]]:
+    """
+    Líneas del texto con su posición, separadas igual que str.splitlines().
+    `stream` puede ser un fichero abierto en modo texto (se lee por bloques) o cualquier iterable de trozos de texto.
+    """
+    pieces = _pieces(stream, block_size)
+    offset = 0
+    carry = ""
+    done = False
+    while not done:
+        piece = next(pieces, None)
+        if piece is None:
+            parts = carry.splitlines(keepends=True)
+            done = True
+        else:
+            parts = (carry + piece).splitlines(keepends=True)
+            carry = ""
+            # La última línea puede seguir en el siguiente trozo (también un "\r" al que siga un "\n")
+            if parts and (parts[-1][-1] not in _LINE_BREAKS or parts[-1][-1] == "\r"):
+                carry = parts.pop()
+        for part in parts:
+            if part[-1] not in _LINE_BREAKS:
+                yield part, offset  # última línea del texto, sin salto
+            elif part.endswith("\r\n"):
+                yield part[:-2], offset
+            else:
+                yield part[:-1], offset
+            offset += len(part)
+
+
+class _ChunkBuilder:
+    """Acumula los bloques de una sección y emite chunks con la regla de split_chunks."""
+
+    def __init__(self, target: int, tol: float):
+        self.lower = target - tol
+        self.upper = target + tol
+        self.parts: list[str] = []
+        self.length = 0
+        self.start = 0
+        self.end = 0
+        self.section = ""
+
+    def add(self, block: str, start: int, end: int) -> Chunk | None:
+        emitted = None
+        if self.parts:
+            candidate_length = self.length + 2 + len(block)
+            if candidate_length <= self.upper or self.length < self.lower:
+                self.parts.append(block)
+                self.length = candidate_length
+                self.end = end
+                return None
+            emitted = self.flush()
+        self.parts = [block]
+        self.length = len(block)
+        self.start, self.end = start, end
+        return emitted
+
+    def flush(self) -> Chunk | None:
+        if not self.parts:
+            return None
+        chunk = Chunk("\n\n".join(self.parts), self.section, self.start, self.end)
+        self.parts = []
+        self.length = 0
+        return chunk
+
+
+def iter_chunks(stream: Iterable[str], target: int = 1000, tol: float = 150) -> Iterator[Chunk]:
+    """
+    Genera los chunks del markdown leído de `stream` (normalmente el fichero abierto) en orden, con su sección
+    y su posición. Memoria acotada por el tamaño de un chunk (y del bloque más largo), tiempo lineal.
+    """
+    builder = _ChunkBuilder(target, tol)
+    block: list[str] = []
+    block_kind = None  # "table" | "paragraph"
+    block_start = 0
+    block_end = 0
+    section_start = True  # la sección se recorta con strip(): se ignora el espacio inicial de su primera línea
+
+    def close_block():
+        nonlocal block, block_kind
+        if not block:
+            return None
+        text = "\n".join(block)
+        stripped = text.strip()
+        block, block_kind = [], None
+        if not stripped:
+            return None
+        leading = len(text) - len(text.lstrip())
+        trailing = len(text) - len(text.rstrip())
+        return builder.add(stripped, block_start + leading, block_end - trailing)
+
+    for line, offset in _lines(stream):
+        if line[:1] == "#" and HEADING.match(line):
+            chunk = close_block()
+            if chunk:
+                yield chunk
+            chunk = builder.flush()
+            if chunk:
+                yield chunk
+            builder.section = line
+            section_start = True
+
+        if section_start:
+            if not line.strip():
+                continue
+            stripped = line.lstrip()
+            offset += len(line) - len(stripped)
+            line = stripped
+            section_start = False
+
+        if line.startswith("|"):
+            kind = "table"
+        elif line.strip():
+            kind = "paragraph"
+        else:
+            # Línea en blanco: cierra el bloque en curso
+            chunk = close_block()
+            if chunk:
+                yield chunk
+            continue
+
+        if block_kind != kind:
+            chunk = close_block()
+            if chunk:
+                yield chunk
+            block_kind = kind
+            block_start = offset
+        block.append(line)
+        block_end = offset + len(line)
+
+    chunk = close_block()
+    if chunk:
+        yield chunk
+    chunk = builder.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple
+
+import httpx
+import openai
+from openai._constants import DEFAULT_CONNECTION_LIMITS
+
+
+class ModelLimits(NamedTuple):
+    rpm: int  # peticiones por minuto
+    tpm: int  # tokens por minuto
+
+
+# Límites por prefijo del nombre del modelo (los nombres con fecha, p.ej. gpt-4.1-mini-2025-04-14, usan el del prefijo).
+# Por defecto los del tier 1 de OpenAI; se sobreescriben con OPENAI_RATE_LIMITS='{"gpt-4.1-mini": [5000, 2000000]}'
+DEFAULT_LIMITS = {
+    "gpt-4.1-mini": ModelLimits(500, 200_000),
+    "o4-mini": ModelLimits(500, 200_000),
+    "text-embedding-3-small": ModelLimits(3000, 1_000_000),
+}
+MAX_RETRIES_429 = 4
+
+# Prioridad de las llamadas del contexto actual: las "interactive" (planificador) pueden usar toda la capacidad,
+# las "normal" (agentes, embeddings) dejan libre una reserva para que el planificador no haga cola tras ellas
+_priority: ContextVar[str] = ContextVar("openai_priority", default="normal")
+
+
+@contextmanager
+def priority(level: str):
+    """Las llamadas a OpenAI dentro del bloque (y de las tareas que lance) usan la prioridad `level`."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _load_limits() -> dict[str, ModelLimits]:
+    limits = dict(DEFAULT_LIMITS)
+    for model, (rpm, tpm) in json.loads(os.getenv("OPENAI_RATE_LIMITS", "{}")).items():
+        limits[model] = ModelLimits(rpm, tpm)
+    return limits
+
+
+class _Bucket:
+    """Token bucket que se rellena de forma continua hasta `capacity` en un minuto."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_for(self, amount: float, reserve: float) -> float:
+        """Segundos hasta que haya `amount` dejando libre `reserve` (0 si ya lo hay)."""
+        missing = amount + reserve - self.level
+        return max(0.0, missing * 60.0 / self.capacity)
+
+
+class _ModelState:
+    def __init__(self, limits: ModelLimits):
+        self.requests = _Bucket(limits.rpm)
+        self.tokens = _Bucket(limits.tpm)
+        self.blocked_until = 0.0
+        # Espera en cola de las últimas peticiones, por prioridad
+        self.waits: dict[str, deque[float]] = {}
+        self.counters = {"requests": 0, "queued": 0, "estimated_tokens": 0, "throttled_429": 0, "retries": 0}
+
+
+class OpenAIRateLimiter:
+    """
+    Limitador de llamadas a OpenAI compartido por todo el proceso (planificador, RagAgent, WebSearchAgent y embeddings).
+    - Por modelo, un token bucket de peticiones por minuto y otro de tokens por minuto. Los tokens de cada
+      petición se estiman por el tamaño del cuerpo y se corrigen con las cabeceras x-ratelimit-remaining-*
+      que devuelve OpenAI (que también cuentan el consumo de otros procesos con la misma clave).
+    - Prioridad: las llamadas normales dejan libre `reserve` de la capacidad para las interactivas.
+    - Un 429 bloquea el modelo durante retry-after (o un backoff exponencial con jitter) y la petición se reintenta.
+    - Métricas de espera en cola por modelo (stats).
+    Es seguro entre hilos (ingesta) y el event loop compartido: el estado se protege con un lock y nunca se espera dentro.
+    """
+
+    def __init__(self, limits: dict[str, ModelLimits] | None = None, reserve: float = 0.2, max_retries: int = MAX_RETRIES_429):
+        self.limits = limits if limits is not None else _load_limits()
+        self.reserve = reserve
+        self.max_retries = max_retries
+        self._models: dict[str, _ModelState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, model: str) -> _ModelState | None:
+        for prefix in sorted(self.limits, key=len, reverse=True):
+            if model.startswith(prefix):
+                state = self._models.get(prefix)
+                if state is None:
+                    state = self._models[prefix] = _ModelState(self.limits[prefix])
+                return state
+        return None  # modelo sin límites configurados
+
+    def _try_acquire(self, model: str, tokens: int, level: str) -> float:
+        """Descuenta la petición si hay capacidad y devuelve 0; si no, los segundos que conviene esperar."""
+        with self._lock:
+            state = self._state(model)
+            if state is None:
+                return 0.0
+            now = time.monotonic()
+            if now < state.blocked_until:
+                return state.blocked_until - now
+            state.requests.refill(now)
+            state.tokens.refill(now)
+            share = 0.0 if level == "interactive" else self.reserve
+            tokens = min(tokens, state.tokens.capacity * (1 - share))
+            wait = max(
+                state.requests.wait_for(1, state.requests.capacity * share),
+                state.tokens.wait_for(tokens, state.tokens.capacity * share),
+            )
+            if wait > 0:
+                return wait
+            state.requests.level -= 1
+            state.tokens.level -= tokens
+            state.counters["requests"] += 1
+            state.counters["estimated_tokens"] += tokens
+            return 0.0
+
+    def _record_wait(self, model: str, level: str, waited: float) -> None:
+        with self._lock:
+            state = self._state(model)
+            if state is not None:
+                state.waits.setdefault(level, deque(maxlen=1000)).append(waited)
+                if waited > 0:
+                    state.counters["queued"] += 1
+
+    async def aacquire(self, model: str, tokens: int) -> None:
+        start = time.monotonic()
+        level = _priority.get()
+        queued = False
+        while (wait := self._try_acquire(model, tokens, level)) > 0:
+            # Se vuelve a comprobar a menudo: otra petición puede haber liberado capacidad o llegar una más prioritaria
+            queued = True
+            await asyncio.sleep(min(wait, 1.0) * random.uniform(0.8, 1.2))
+        self._record_wait(model, level, time.monotonic() - start if queued else 0.0)
+
+    def acquire(self, model: str, tokens: int) -> None:
+        start = time.monotonic()
+        level = _priority.get()
+        queued = False
+        while (wait := self._try_acquire(model, tokens, level)) > 0:
+            queued = True
+            time.sleep(min(wait, 1.0) * random.uniform(0.8, 1.2))
+        self._record_wait(model, level, time.monotonic() - start if queued else 0.0)
+
+    def update(self, model: str, headers: httpx.Headers) -> None:
+        """Ajusta los buckets a lo que OpenAI dice que queda (solo a la baja: la estimación local ya descuenta lo pedido)."""
+        with self._lock:
+            state = self._state(model)
+            if state is None:
+                return
+            for bucket, header in ((state.requests, "x-ratelimit-remaining-requests"), (state.tokens, "x-ratelimit-remaining-tokens")):
+                try:
+                    bucket.level = min(bucket.level, float(headers[header]))
+                except (KeyError, ValueError):
+                    pass
+
+    def penalize(self, model: str, headers: httpx.Headers, attempt: int) -> float:
+        """Tras un 429 bloquea el modelo y devuelve cuánto esperar antes de reintentar."""
+        delay = _retry_after(headers)
+        if delay is None:
+            # Backoff exponencial con "full jitter": las peticiones que fallaron a la vez no se reintentan a la vez
+            delay = random.uniform(0.5, 1.0) * min(30.0, 2.0 ** attempt)
+        with self._lock:
+            state = self._state(model)
+            if state is not None:
+                state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+                state.counters["throttled_429"] += 1
+                state.counters["retries"] += attempt < self.max_retries
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for prefix, state in self._models.items():
+                result[prefix] = {
+                    **state.counters,
+                    "queue_wait": {level: _wait_stats(waits) for level, waits in state.waits.items()},
+                    "requests_available": int(state.requests.level),
+                    "tokens_available": int(state.tokens.level),
+                }
+            return result
+
+
+def _wait_stats(waits) -> dict:
+    waits = sorted(waits)
+    return {
+        "avg_ms": round(1000 * sum(waits) / len(waits), 1),
+        "p95_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1),
+        "max_ms": round(1000 * waits[-1], 1),
+    }
+
+
+def _retry_after(headers: httpx.Headers) -> float | None:
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, ValueError):
+            continue
+    return None
+
+
+def _request_cost(request: httpx.Request) -> tuple[str | None, int]:
+    """Modelo y tokens estimados de una petición a la API (≈ 4 caracteres por token del cuerpo)."""
+    if request.method != "POST":
+        return None, 0
+    try:
+        body = request.content
+        model = json.loads(body).get("model")
+    except (httpx.RequestNotRead, ValueError, AttributeError):
+        return None, 0
+    return model, len(body) // 4 + 1
+
+
+class RateLimitedAsyncTransport(httpx.AsyncBaseTransport):
+    """Transporte httpx que pasa cada petición a OpenAI por el limitador y reintenta los 429."""
+
+    def __init__(self, limiter: OpenAIRateLimiter, transport: httpx.AsyncBaseTransport | None = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.AsyncHTTPTransport(limits=DEFAULT_CONNECTION_LIMITS)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        model, tokens = _request_cost(request)
+        if model is None:
+            return await self.transport.handle_async_request(request)
+        for attempt in range(self.limiter.max_retries + 1):
+            await self.limiter.aacquire(model, tokens)
+            response = await self.transport.handle_async_request(request)
+            self.limiter.update(model, response.headers)
+            if response.status_code != 429 or attempt == self.limiter.max_retries:
+                return response
+            await response.aclose()
+            await asyncio.sleep(self.limiter.penalize(model, response.headers, attempt))
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Versión síncrona de RateLimitedAsyncTransport (ingesta desde hilos)."""
+
+    def __init__(self, limiter: OpenAIRateLimiter, transport: httpx.BaseTransport | None = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.HTTPTransport(limits=DEFAULT_CONNECTION_LIMITS)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        model, tokens = _request_cost(request)
+        if model is None:
+            return self.transport.handle_request(request)
+        for attempt in range(self.limiter.max_retries + 1):
+            self.limiter.acquire(model, tokens)
+            response = self.transport.handle_request(request)
+            self.limiter.update(model, response.headers)
+            if response.status_code != 429 or attempt == self.limiter.max_retries:
+                return response
+            response.close()
+            time.sleep(self.limiter.penalize(model, response.headers, attempt))
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+# Limitador único del proceso
+openai_limiter = OpenAIRateLimiter()
+
+
+def limited_http_client() -> httpx.Client:
+    return openai.DefaultHttpxClient(transport=RateLimitedTransport(openai_limiter))
+
+
+def limited_async_http_client() -> httpx.AsyncClient:
+    return openai.DefaultAsyncHttpxClient(transport=RateLimitedAsyncTransport(openai_limiter))
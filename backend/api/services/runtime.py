@@ -0,0 +1,73 @@
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Registro de servicios compartidos por todos los blueprints del proceso.
+# Se construyen una sola vez (de forma perezosa, en la primera petición que los necesita), así
+# los tres blueprints comparten clientes de OpenAI, vectorstore, RagAgent y la memoria de conversación.
+_lock = threading.Lock()
+_services: dict[str, object] = {}
+_stats: dict[str, dict] = {}
+
+
+def _rss_mb() -> float:
+    """Memoria máxima residente del proceso en MB (ru_maxrss viene en KB en Linux)."""
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _get_or_create(name: str, factory):
+    service = _services.get(name)
+    if service is not None:
+        return service
+    with _lock:
+        service = _services.get(name)
+        if service is None:
+            rss_before = _rss_mb()
+            start = time.perf_counter()
+            service = factory()
+            _stats[name] = {
+                "startup_seconds": round(time.perf_counter() - start, 3),
+                "rss_before_mb": round(rss_before, 1),
+                "rss_after_mb": round(_rss_mb(), 1),
+            }
+            print(f"[runtime] {name} inicializado: {_stats[name]}")
+            _services[name] = service
+    return service
+
+
+def get_chat_service():
+    """ChatService único del proceso (LLMs, GlobalAgent, RagAgent y MemorySaver compartidos)."""
+    from services.chat_service import ChatService
+    return _get_or_create("chat_service", ChatService)
+
+
+def get_ingestion_jobs():
+    """Gestor de trabajos de ingesta en segundo plano (pools acotados de parseo e indexación)."""
+    from services.ingestion_jobs import IngestionJobManager
+    return _get_or_create("ingestion_jobs", IngestionJobManager)
+
+
+def runtime_stats() -> dict:
+    """Tiempo de arranque y memoria de cada servicio inicializado, y estado de las caches."""
+    from services import vectorstore_cache
+    stats = {
+        "services": dict(_stats),
+        "rss_mb": round(_rss_mb(), 1),
+    }
+    if vectorstore_cache._embeddings is not None:
+        stats["embedding_cache"] = vectorstore_cache._embeddings.stats()
+    if "chat_service" in _services:
+        stats["llm_cache"] = _services["chat_service"].llm_cache.stats()
+        stats["checkpointer"] = _services["chat_service"].checkpointer.stats()
+        stats["rag_relevance"] = _services["chat_service"].global_agent.rag_agent.relevance_stats()
+    from services.agents.asyncwebsearch import search_cache
+    stats["search_cache"] = search_cache.stats()
+    from services.openai_limiter import openai_limiter
+    stats["openai_limiter"] = openai_limiter.stats()
+    return stats
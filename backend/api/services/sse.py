@@ -0,0 +1,52 @@
+import json
+
+from services.agents.rag_agent_utils import get_icon
+
+
+# Cabeceras para que proxies (nginx) no almacenen el stream en buffer
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(payload: dict) -> str:
+    """Serializa un evento en formato Server-Sent Events."""
+    return f"data:{json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def chunk_to_event(chunk: dict) -> dict | None:
+    """
+    Traduce un chunk del stream "custom" de los grafos a un evento para el frontend.
+    - custom_key: progreso de los nodos
+    - plan_key:   decisión del planificador (web|||rag|||respuesta)
+    - rag_key / web_key: informe de cada subagente
+    - token_key:  trozo de un informe según lo escribe el modelo (agent: rag, web o final), con el id de la
+                  generación (attempt). Cada generación empieza con un evento token_start: el cliente descarta el
+                  borrador que tuviera de ese agente y concatena los trozos que siguen con el mismo attempt.
+                  El texto completo llega después en report/final
+    - final_key:  respuesta final de la conversación
+    - error_key:  error durante la ejecución del grafo
+    """
+    if chunk.get("error_key"):
+        event = {"type": "error", "text": chunk["error_key"], "isFinal": True}
+        if chunk.get("status"):
+            event["status"] = chunk["status"]  # 504: se ha agotado el tiempo máximo de la petición
+        return event
+    if chunk.get("final_key") is not None:
+        return {"type": "final", "text": chunk["final_key"], "isFinal": True}
+    if chunk.get("plan_key"):
+        web, rag, _ = chunk["plan_key"].split("|||", 2)
+        return {"type": "plan", "web": web == "True", "rag": rag == "True", "icon": "Brain"}
+    if chunk.get("rag_key"):
+        return {"type": "report", "agent": "rag", "text": chunk["rag_key"]}
+    if chunk.get("web_key"):
+        return {"type": "report", "agent": "web", "text": chunk["web_key"]}
+    if chunk.get("token_key"):
+        token = chunk["token_key"]
+        if token.get("start"):
+            return {"type": "token_start", "agent": token["agent"], "attempt": token["attempt"]}
+        return {"type": "token", "agent": token["agent"], "attempt": token["attempt"], "text": token["text"]}
+    if chunk.get("custom_key"):
+        return {"type": "progress", "text": chunk["custom_key"], "icon": get_icon(chunk) or "Bot"}
+    return None
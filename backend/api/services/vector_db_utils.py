@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 from langchain.schema import Document
@@ -7,6 +8,12 @@ import nest_asyncio
 from llama_parse import LlamaParse
 from dotenv import load_dotenv
 import re
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services.vectorstore_cache import VECTORSTORE_DIR, vectorstore_cache
+from services.lexical_index import get_lexical_index
+from services.md_chunker import iter_chunks
 
 # Api keys
 load_dotenv()
@@ -153,10 +160,109 @@ def process_pdf(uploaded_dir, processed_dir, pdf_name):
     # Create the md file
     md_name = pdf_name.replace(".pdf", ".md")
     file_name_md = f"./{processed_dir}/{md_name}"
-    with open(file_name_md, "w", encoding="utf-8") as f:
+    tmp = file_name_md + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         for i in range(len(document)):
             f.write(document[i].text)
-    
+    os.replace(tmp, file_name_md)
+
+class LocalPdfParser:
+    """
+    Sustituto local de LlamaParse (extrae el texto con pypdf) para ejecutar y medir
+    el parseo sin conexión. Acepta `target_pages` igual que LlamaParse.
+    """
+    def __init__(self, target_pages=None, delay_per_page=0.0):
+        self.target_pages = target_pages
+        self.delay_per_page = delay_per_page  # simula la latencia del servicio remoto
+
+    def load_data(self, file_name):
+        from pypdf import PdfReader
+        reader = PdfReader(file_name)
+        if self.target_pages:
+            pages = [int(p) for p in self.target_pages.split(",")]
+        else:
+            pages = range(len(reader.pages))
+        documents = []
+        for p in pages:
+            if self.delay_per_page:
+                time.sleep(self.delay_per_page)
+            # Mismo interfaz que los documentos de LlamaParse (atributo .text)
+            documents.append(SimpleNamespace(text=(reader.pages[p].extract_text() or "") + "\n\n"))
+        return documents
+
+def llama_parser(target_pages=None):
+    return LlamaParse(
+        result_type="markdown",
+        auto_mode_trigger_on_table_in_page=True,
+        target_pages=target_pages,
+    )
+
+def count_pdf_pages(file_name):
+    """Número de páginas del PDF, o None si pypdf no está instalado o no se puede leer."""
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(file_name).pages)
+    except Exception:
+        return None
+
+def _page_ranges(n_pages, pages_per_split):
+    return [
+        ",".join(str(p) for p in range(start, min(start + pages_per_split, n_pages)))
+        for start in range(0, n_pages, pages_per_split)
+    ]
+
+def process_pdfs(uploaded_dir, processed_dir, pdf_names, max_workers=4, pages_per_split=None, parser_factory=llama_parser, on_parsed=None):
+    """
+    Parsea varios PDFs en paralelo (como mucho `max_workers` peticiones simultáneas al parser).
+    Si `pages_per_split` está definido, los PDFs con más páginas se dividen en rangos que se parsean
+    en paralelo y se vuelven a unir en orden. `parser_factory(target_pages)` permite usar LocalPdfParser.
+    `on_parsed(pdf_name)` se llama cuando el markdown de cada fichero está escrito.
+    Devuelve {pdf_name: ruta del markdown}.
+    """
+    os.makedirs(processed_dir, exist_ok=True)
+    # Unidades de trabajo: (fichero, rango de páginas); None = documento completo
+    units = []
+    for pdf_name in pdf_names:
+        n_pages = count_pdf_pages(f"{uploaded_dir}/{pdf_name}") if pages_per_split else None
+        if n_pages and n_pages > pages_per_split:
+            units.extend((pdf_name, i, pages) for i, pages in enumerate(_page_ranges(n_pages, pages_per_split)))
+        else:
+            units.append((pdf_name, 0, None))
+    pending = {}
+    for pdf_name, _, _ in units:
+        pending[pdf_name] = pending.get(pdf_name, 0) + 1
+
+    def _parse(unit):
+        pdf_name, _, pages = unit
+        parser = parser_factory(pages)
+        return parser.load_data(f"{uploaded_dir}/{pdf_name}")
+
+    parts = {pdf_name: {} for pdf_name in pending}
+    outputs = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_parse, unit): unit for unit in units}
+        for future in as_completed(futures):
+            pdf_name, index, _ = futures[future]
+            parts[pdf_name][index] = future.result()
+            pending[pdf_name] -= 1
+            if pending[pdf_name] == 0:
+                # Todas las partes del fichero listas: se escriben en orden
+                md_name = pdf_name.replace(".pdf", ".md")
+                file_name_md = os.path.join(processed_dir, md_name)
+                # Se escribe aparte y se renombra: la ingesta de otro trabajo (process_md_dir) lee el mismo
+                # directorio y nunca debe ver un markdown a medias
+                tmp = file_name_md + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    for i in sorted(parts[pdf_name]):
+                        for doc in parts[pdf_name][i]:
+                            f.write(doc.text)
+                os.replace(tmp, file_name_md)
+                outputs[pdf_name] = file_name_md
+                del parts[pdf_name]
+                if on_parsed:
+                    on_parsed(pdf_name)
+    return outputs
+
 def process_md(pdf_name):
     """Process a markdown file and creates a vectorstore."""
     # Read the markdown file
@@ -201,44 +307,204 @@ def process_md(pdf_name):
     # Persistir la base de datos
     vectorstore.persist()
 
-def process_md_dir(dir_name):
-    """Process all markdown files in a directory."""
-    # List all files in the directory
-    files = os.listdir(dir_name)
+###
+# INGESTA INCREMENTAL
+###
+MANIFEST_NAME = "ingestion_manifest.json"
+# Versión 2: metadatos por chunk (sección, tipo de contenido, años del contenido y posiciones)
+MANIFEST_VERSION = 2
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_ids(file_name, chunks):
+    """
+    Ids deterministas para los chunks de un fichero: hash del nombre del fichero y del contenido.
+    Un chunk que no cambia conserva su id aunque se inserten o borren otros chunks del fichero.
+    Los chunks repetidos dentro del mismo fichero se distinguen con un contador.
+    """
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        base = hash_text(f"{file_name}\0{chunk}")[:32]
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        ids.append(base if n == 0 else f"{base}-{n}")
+    return ids
+
+def load_manifest(persist_dir):
+    path = os.path.join(persist_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(persist_dir, manifest):
+    os.makedirs(persist_dir, exist_ok=True)
+    path = os.path.join(persist_dir, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+YEAR_IN_TEXT = re.compile(r'\b(?:19|20)\d{2}\b')
+
+def section_heading(heading_line):
+    """Texto de la línea de encabezado Markdown de la sección, sin los '#'."""
+    return heading_line.lstrip("#").strip()[:200]
+
+def content_type(chunk):
+    """"table", "paragraph" o "mixed" según los bloques del chunk."""
+    tables = [b.startswith("|") for b in split_paragraphs_and_tables(chunk)]
+    if tables and all(tables):
+        return "table"
+    return "mixed" if any(tables) else "paragraph"
+
+def chunk_metadata(file_name, year, heading_line, chunk, start_char, end_char):
+    """
+    Metadatos de un chunk. Chroma solo admite valores escalares, así que los años mencionados
+    en el contenido van como texto ("years") y como una marca por año ("year_2023": True) para poder filtrar.
+    """
+    years = sorted(set(YEAR_IN_TEXT.findall(chunk)))
+    metadata = {
+        "source": file_name,
+        "section": section_heading(heading_line),
+        "content_type": content_type(chunk),
+        "years": ",".join(years),
+        "start_char": start_char,
+        "end_char": end_char,
+    }
+    if year:
+        metadata["year"] = year
+    for y in years:
+        metadata[f"year_{y}"] = True
+    return metadata
+
+def file_hash(path, block_size=1 << 20):
+    """Igual que hash_text(contenido del fichero) pero leyéndolo por bloques."""
+    digest = hashlib.sha256()
+    with open(path, "r", encoding="utf-8") as f:
+        while block := f.read(block_size):
+            digest.update(block.encode("utf-8"))
+    return digest.hexdigest()
+
+def md_to_documents(file_name, stream):
+    """
+    Divide un markdown en chunks y devuelve (ids, documentos) con sus metadatos.
+    `stream` es el fichero abierto (o cualquier iterable de líneas): se trocea en streaming con iter_chunks.
+    """
+    # extracción del año (segun el titulo)
+    match = re.search(r'\b(19|20)\d{2}\b', file_name)
+    year = match.group(0) if match else None
+
+    chunks = list(iter_chunks(stream, target=1000, tol=150))
+    ids = chunk_ids(file_name, [c.text for c in chunks])
+
     documents = []
+    for chunk_id, chunk in zip(ids, chunks):
+        metadata = {**chunk_metadata(file_name, year, chunk.section, chunk.text, chunk.start, chunk.end), "chunk_id": chunk_id}
+        documents.append(Document(page_content=chunk.text, metadata=metadata))
+    return ids, documents
+
+def _batched(vectorstore, items):
+    # Chroma rechaza las escrituras de más de max_batch_size elementos (como hacía from_documents, se trocean)
+    size = vectorstore._client.get_max_batch_size()
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def process_md_dir(dir_name, persist_dir=VECTORSTORE_DIR, on_stage=None):
+    """
+    Ingesta incremental de todos los markdown de un directorio en el vectorstore.
+    Mantiene un manifiesto con el hash de cada fichero y los ids de sus chunks:
+    - Los ficheros sin cambios no se vuelven a trocear ni a embeber.
+    - De los ficheros modificados solo se embeben los chunks nuevos y se borran los que ya no existen.
+    - Se borran los chunks de los ficheros que ya no están en el directorio.
+    El índice léxico (BM25) se actualiza con los mismos cambios que la colección.
+    `on_stage(md_file, stage)` se llama según avanza cada fichero: "chunked", "embedded", "indexed".
+    """
+    # El handle no se cierra por inactividad mientras dure la ingesta
+    with vectorstore_cache.use(persist_dir) as vectorstore:
+        return _process_md_dir(vectorstore, dir_name, persist_dir, on_stage)
+
+
+def _process_md_dir(vectorstore, dir_name, persist_dir, on_stage):
+    def _stage(file, stage):
+        if on_stage:
+            on_stage(file, stage)
+
+    lexical_index = get_lexical_index(persist_dir)
+    manifest = load_manifest(persist_dir)
+    if manifest is None or manifest.get("version") != MANIFEST_VERSION or (manifest["files"] and vectorstore._collection.count() == 0):
+        # Sin manifiesto, de una versión con otros metadatos o con la colección borrada: se reindexa todo
+        # (los embeddings salen de la cache, así que solo cuesta volver a escribir la colección)
+        legacy_ids = vectorstore._collection.get(include=[])["ids"]
+        if legacy_ids:
+            print(f"Eliminando {len(legacy_ids)} chunks de ingestas anteriores para reindexarlos.")
+            for batch in _batched(vectorstore, legacy_ids):
+                vectorstore.delete(ids=batch)
+        manifest = {"version": MANIFEST_VERSION, "files": {}}
+        lexical_index.clear()
+    elif manifest["files"] and not len(lexical_index):
+        # Colección ingerida antes de existir el índice léxico: se construye a partir de lo que ya hay en Chroma
+        existing = vectorstore._collection.get(include=["documents", "metadatas"])
+        lexical_index.add(existing["ids"], existing["documents"], existing["metadatas"])
+        lexical_index.save()
+        print(f"Índice léxico construido con {len(existing['ids'])} chunks existentes.")
+
+    stats = {"added": 0, "deleted": 0, "unchanged_files": 0, "updated_files": 0, "removed_files": 0}
+    files = sorted(f for f in os.listdir(dir_name) if f.endswith(".md"))
     for file in files:
-        if file.endswith(".md"):
-            # extracción del año (segun el titulo)
-            match = re.search(r'\b(19|20)\d{2}\b', file)
-            year = match.group(0) if match else None
-
-            file_path = os.path.join(dir_name, file)
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                #chunks = chunk_text(content, chunk_size=1000)
-                sections = split_sections(content)
-                chunks = split_chunks(sections, target=1000, tol=150)
-            
-            
-            # Crear un objeto Document para cada chunk, manteniendo los metadatos
-            for chunk in chunks:
-                if year:
-                    doc = Document(page_content=chunk, metadata={"year": year})
-                    print(f"Agregado chunk de '{file}' (year={year}): {chunk[:80]}...")
-                else:
-                    doc = Document(page_content=chunk)
-                
-                documents.append(doc)
+        file_path = os.path.join(dir_name, file)
+        current_hash = file_hash(file_path)
+        entry = manifest["files"].get(file)
+        if entry and entry["hash"] == current_hash:
+            stats["unchanged_files"] += 1
+            _stage(file, "indexed")
+            continue
 
-    # Configurar embeddings
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, model="text-embedding-3-small") # TRy the voyager embeddings model
+        with open(file_path, "r", encoding="utf-8") as f:
+            ids, documents = md_to_documents(file, f)
+        _stage(file, "chunked")
+        old_ids = set(entry["chunks"]) if entry else set()
+        new_docs = [(i, d) for i, d in zip(ids, documents) if i not in old_ids]
+        removed = list(old_ids - set(ids))
+        if new_docs:
+            # Los embeddings quedan en la cache, add_documents los reutiliza al indexar
+            vectorstore.embeddings.embed_documents([d.page_content for _, d in new_docs])
+        _stage(file, "embedded")
+        if new_docs:
+            for batch in _batched(vectorstore, new_docs):
+                vectorstore.add_documents([d for _, d in batch], ids=[i for i, _ in batch])
+            lexical_index.add([i for i, _ in new_docs], [d.page_content for _, d in new_docs], [d.metadata for _, d in new_docs])
+            print(f"Agregados {len(new_docs)} chunks nuevos de '{file}'.")
+        if removed:
+            for batch in _batched(vectorstore, removed):
+                vectorstore.delete(ids=batch)
+            lexical_index.remove(removed)
+        stats["added"] += len(new_docs)
+        stats["deleted"] += len(removed)
+        stats["updated_files"] += 1
+        manifest["files"][file] = {"hash": current_hash, "chunks": ids}
+        # Se guarda tras cada fichero para no repetir trabajo si la ingesta se interrumpe
+        lexical_index.save()
+        save_manifest(persist_dir, manifest)
+        _stage(file, "indexed")
 
-    # Crear el vectorstore en Chroma
-    persist_dir = r"C:\Users\alber_7dxjh2i\OneDrive\Documentos\alberto\AI Agents\Code\global_agent\api\services\agents\vectorstore_chromadb_automatic"
-    #os.makedirs(persist_dir, exist_ok=True)
-    #if not os.path.exists(persist_dir):
-    #    os.makedirs(persist_dir)
-    vectorstore = Chroma.from_documents(documents=documents, embedding=embeddings, persist_directory=persist_dir)
+    for file in [f for f in manifest["files"] if f not in files]:
+        removed = manifest["files"].pop(file)["chunks"]
+        if removed:
+            for batch in _batched(vectorstore, removed):
+                vectorstore.delete(ids=batch)
+            lexical_index.remove(removed)
+        stats["deleted"] += len(removed)
+        stats["removed_files"] += 1
+
+    lexical_index.save()
+    save_manifest(persist_dir, manifest)
+    vectorstore_cache.refresh(persist_dir)
+    print(f"Ingesta completada: {stats}")
+    return stats
 
 """
 if __name__ == "__main__":
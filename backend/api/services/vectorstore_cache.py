@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import openai
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.vectorstores import Chroma
+
+from services.embedding_cache import CachedEmbeddings
+from services.openai_limiter import limited_async_http_client, limited_http_client
+
+# Directorio y colección por defecto del vectorstore (relativos a backend/api)
+VECTORSTORE_DIR = "./services/agents/vectorstore_chromadb_automatic"
+DEFAULT_COLLECTION = "langchain"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings():
+    """Cliente de embeddings compartido por la ingesta y las consultas, con cache persistente en disco."""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            # Los fallos de cache pasan por el limitador de OpenAI del proceso (clientes sync y async por separado)
+            api_key = os.getenv("OPENAI_API_KEY")
+            client = OpenAIEmbeddings(
+                api_key=api_key,
+                model=EMBEDDING_MODEL,
+                client=openai.OpenAI(api_key=api_key, http_client=limited_http_client()).embeddings,
+                async_client=openai.AsyncOpenAI(api_key=api_key, http_client=limited_async_http_client()).embeddings,
+            )
+            _embeddings = CachedEmbeddings(client, EMBEDDING_MODEL)
+    return _embeddings
+
+
+def _index_signature(persist_directory: str) -> tuple:
+    """
+    Firma del índice en disco: (mtime, tamaño) de chroma.sqlite3 y de los ficheros de los segmentos HNSW.
+    Si cambia, alguien ha reescrito la colección y hay que reabrir el handle.
+    """
+    signature = []
+    if not os.path.isdir(persist_directory):
+        return ()
+    for root, _, files in os.walk(persist_directory):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            signature.append((os.path.relpath(os.path.join(root, name), persist_directory), st.st_mtime_ns, st.st_size))
+    return tuple(sorted(signature))
+
+
+class _Handle:
+    def __init__(self, vectorstore, signature):
+        self.vectorstore = vectorstore
+        self.signature = signature
+        self.checked_at = time.monotonic()
+        self.last_used = time.monotonic()
+        self.users = 0  # bloques use() en curso con este handle
+
+
+class VectorStoreCache:
+    """
+    Cache de handles de Chroma por (persist_directory, collection_name).
+    - Reutiliza la colección abierta (y su índice HNSW cargado) entre peticiones.
+    - Reabre el handle si el índice en disco ha cambiado desde que se abrió (se comprueba como mucho
+      cada `signature_ttl` segundos: la firma recorre el directorio entero).
+    - Un hilo cierra cada `sweep_interval` segundos los handles que llevan más de `idle_seconds` sin usarse
+      y que nadie está usando (use()).
+    """
+
+    def __init__(self, idle_seconds: float = 900, signature_ttl: float = 5.0, sweep_interval: float = 60.0):
+        self.idle_seconds = idle_seconds
+        self.signature_ttl = signature_ttl
+        self.sweep_interval = sweep_interval
+        self._handles: dict[tuple[str, str], _Handle] = {}
+        self._active_users = 0  # incluye los de handles ya sustituidos por una versión más nueva
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def get(self, persist_directory: str = VECTORSTORE_DIR, collection_name: str = DEFAULT_COLLECTION) -> Chroma:
+        """Handle de la colección. Para usarlo durante una petición o una ingesta, mejor use()."""
+        return self._acquire(persist_directory, collection_name, 0).vectorstore
+
+    @contextmanager
+    def use(self, persist_directory: str = VECTORSTORE_DIR, collection_name: str = DEFAULT_COLLECTION):
+        """Handle de la colección que no se cierra por inactividad mientras dure el bloque."""
+        handle = self._acquire(persist_directory, collection_name, 1)
+        try:
+            yield handle.vectorstore
+        finally:
+            with self._lock:
+                handle.users -= 1
+                self._active_users -= 1
+                handle.last_used = time.monotonic()
+
+    def _acquire(self, persist_directory: str, collection_name: str, users: int) -> _Handle:
+        key = (os.path.abspath(persist_directory), collection_name)
+        now = time.monotonic()
+        with self._lock:
+            handle = self._handles.get(key)
+            fresh = handle is not None and now - handle.checked_at < self.signature_ttl
+        signature = None if fresh else _index_signature(key[0])
+        with self._lock:
+            self._start_sweeper()
+            handle = self._handles.get(key)
+            if handle is None or (signature is not None and handle.signature != signature):
+                vectorstore = Chroma(
+                    persist_directory=persist_directory,
+                    collection_name=collection_name,
+                    embedding_function=get_embeddings(),
+                )
+                # Al abrir la colección Chroma puede crear ficheros, se recalcula la firma
+                handle = _Handle(vectorstore, _index_signature(key[0]))
+                self._handles[key] = handle
+            elif signature is not None:
+                handle.checked_at = now
+            handle.last_used = now
+            handle.users += users
+            self._active_users += users
+            return handle
+
+    def refresh(self, persist_directory: str = VECTORSTORE_DIR, collection_name: str = DEFAULT_COLLECTION) -> None:
+        """Marca el handle como actualizado tras escribir en él desde este mismo proceso (evita reabrirlo)."""
+        key = (os.path.abspath(persist_directory), collection_name)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                handle.signature = _index_signature(key[0])
+                handle.checked_at = time.monotonic()
+
+    def _start_sweeper(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="vectorstore-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.close_idle()
+            except Exception as e:
+                print(f"[vectorstore_cache] could not close idle handles: {e}")
+
+    def close_idle(self) -> None:
+        with self._lock:
+            self._close_idle()
+
+    def _close_idle(self) -> None:
+        now = time.monotonic()
+        evicted = False
+        for key, handle in list(self._handles.items()):
+            if handle.users == 0 and now - handle.last_used > self.idle_seconds:
+                del self._handles[key]
+                evicted = True
+        # Los clientes de Chroma son compartidos: solo se liberan si nadie usa ningún handle
+        if evicted and not self._handles and self._active_users == 0:
+            # Sin handles vivos liberamos también los clientes de Chroma (índices HNSW en memoria)
+            try:
+                from chromadb.api.client import SharedSystemClient
+                SharedSystemClient.clear_system_cache()
+            except Exception:
+                pass
+
+
+vectorstore_cache = VectorStoreCache()
@@ -45,7 +45,11 @@ export async function uploadFiles(files: File[], conversationId: string, agentTy
   return res.json()
 }
 
-// Creación de vectorstore
+// Creación de vectorstore: el backend lanza la ingesta en segundo plano y devuelve un job_id,
+// se consulta su estado hasta que termina, falla o se supera el tiempo máximo de espera
+const VECTOR_DB_POLL_MS = 2000
+const VECTOR_DB_MAX_WAIT_MS = 30 * 60 * 1000
+
 export async function generateVectorDb(
   filePaths: { name: string; path: string; size: number }[],
   conversationId: string,
@@ -60,5 +64,16 @@ export async function generateVectorDb(
     }),
   });
   if (!res.ok) throw new Error(`HTTP ${res.status}`);
-  return res.json() as Promise<{ status: string; message?: string }>;
+  const { job_id } = (await res.json()) as { status: string; job_id: string };
+
+  const deadline = Date.now() + VECTOR_DB_MAX_WAIT_MS;
+  while (Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, VECTOR_DB_POLL_MS));
+    const statusRes = await fetch(`${API_BASE_URL}/${agentType}/generate-vector-db/${job_id}`);
+    if (!statusRes.ok) throw new Error(`HTTP ${statusRes.status}`);
+    const job = (await statusRes.json()) as { status: string; error?: string; files: Record<string, string> };
+    if (job.status === "done") return { status: "success", message: "Vector-DB created" };
+    if (job.status === "failed") return { status: "error", message: job.error };
+  }
+  return { status: "error", message: "Timed out waiting for the vector DB to be created" };
 }
\ No newline at end of file